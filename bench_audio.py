@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the PCM audio sources
+
+Compares the old grow-and-shift bytearray buffer against PCMRingBuffer, and (when
+ffmpeg is installed) BetterFFmpegPCMAudio against discord.FFmpegPCMAudio on a
+synthetic tone.
+
+    python bench_audio.py [seconds of audio]
+"""
+
+import io
+import os
+import shutil
+import statistics
+import sys
+import threading
+import time
+
+import discord
+
+from shuffle.player.ffmpeg_audio import BetterFFmpegPCMAudio, PCMRingBuffer, FRAME_SIZE, BYTES_PER_SECOND
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(name, elapsed, frames, latencies, extra=''):
+    print(
+        f"  {name:<28} {elapsed * 1000:>9.1f} ms total | {frames:>6} frames | "
+        f"read p50 {percentile(latencies, 50) * 1e6:>7.1f} us  p99 {percentile(latencies, 99) * 1e6:>8.1f} us"
+        f"{'  | ' + extra if extra else ''}"
+    )
+
+
+def bench_bytearray(data):
+    """The previous BetterFFmpegPCMAudio buffer: a bytearray grown at the end and shifted down by every read (copy + del from the front)"""
+    src = io.BufferedReader(io.BytesIO(data))
+    buffer = bytearray()
+    done = threading.Event()
+    peak = 0
+
+    def writer():
+        nonlocal peak
+        while True:
+            chunk = src.read(4096)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            peak = max(peak, len(buffer))
+        done.set()
+
+    thread = threading.Thread(target=writer)
+    start = time.perf_counter()
+    thread.start()
+
+    frames = 0
+    latencies = []
+    while True:
+        t = time.perf_counter()
+        if len(buffer) < FRAME_SIZE and not done.is_set():
+            continue
+        if not buffer:
+            break
+        frame = bytes(buffer[:FRAME_SIZE])
+        del buffer[:len(frame)]
+        latencies.append(time.perf_counter() - t)
+        frames += 1
+
+    elapsed = time.perf_counter() - start
+    thread.join()
+    report('bytearray (old)', elapsed, frames, latencies, f'peak buffer {peak / 1024:.0f} KiB')
+
+
+def bench_ring(data):
+    src = io.BufferedReader(io.BytesIO(data))
+    ring = PCMRingBuffer(int(5 * BYTES_PER_SECOND) // FRAME_SIZE * FRAME_SIZE)
+
+    def writer():
+        while ring.write_from(src.readinto1):
+            pass
+        ring.close()
+
+    thread = threading.Thread(target=writer)
+    start = time.perf_counter()
+    thread.start()
+
+    frames = 0
+    latencies = []
+    while True:
+        t = time.perf_counter()
+        frame = ring.read(FRAME_SIZE, timeout=5)
+        if not frame:
+            break
+        latencies.append(time.perf_counter() - t)
+        frames += 1
+
+    elapsed = time.perf_counter() - start
+    thread.join()
+    report(
+        'PCMRingBuffer', elapsed, frames, latencies,
+        f'capacity {ring.capacity / 1024:.0f} KiB, overruns {ring.overruns}, underruns {ring.underruns}'
+    )
+
+
+def bench_source(name, source):
+    start = time.perf_counter()
+    first = None
+    frames = 0
+    latencies = []
+
+    while True:
+        t = time.perf_counter()
+        frame = source.read()
+        if not frame:
+            break
+        latencies.append(time.perf_counter() - t)
+        if first is None:
+            first = time.perf_counter() - start
+        frames += 1
+
+    elapsed = time.perf_counter() - start
+    source.cleanup()
+    report(name, elapsed, frames, latencies, f'first frame {(first or 0) * 1000:.1f} ms')
+
+
+def main(seconds):
+    print(f'Buffer only, {seconds:.0f}s of audio ({seconds * BYTES_PER_SECOND / 1024 / 1024:.1f} MiB)')
+    data = os.urandom(int(seconds * BYTES_PER_SECOND))
+    bench_bytearray(data)
+    bench_ring(data)
+
+    print()
+    if shutil.which('ffmpeg') is None:
+        print('ffmpeg not found, skipping source comparison')
+        return
+
+    tone = f'sine=frequency=440:duration={seconds:.0f}'
+    print(f'FFmpeg sources, lavfi {tone}')
+    bench_source('discord.FFmpegPCMAudio', discord.FFmpegPCMAudio(tone, before_options='-f lavfi'))
+    bench_source('BetterFFmpegPCMAudio', BetterFFmpegPCMAudio(tone, before_options='-f lavfi'))
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    main(seconds)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the gateway intents profiles
+
+Logs the bot in once per profile, each in a fresh process, and reports the time
+from login to ready (which for 'full' includes chunking every guild), the resident
+memory once ready and how much of the guilds' members ended up cached.
+
+    DISCORD_BOT_TOKEN=... python bench_intents.py [profile ...]
+"""
+
+import asyncio
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from dotenv import load_dotenv
+
+PROFILES = ('minimal', 'full')
+READY_TIMEOUT = 600.0
+
+def rss_mib():
+    """Current resident memory, the peak where /proc is not available"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+async def measure(profile):
+    from shuffle.launcher import create_bot
+
+    baseline = rss_mib()
+    bot = create_bot(None, None, profile)
+    ready = asyncio.Event()
+
+    @bot.event
+    async def on_ready():
+        ready.set()
+
+    start = time.perf_counter()
+    task = asyncio.get_event_loop().create_task(bot.start(os.environ['DISCORD_BOT_TOKEN']))
+    try:
+        await asyncio.wait_for(ready.wait(), READY_TIMEOUT)
+        elapsed = time.perf_counter() - start
+
+        gc.collect()
+        return {
+            'ready': elapsed,
+            'rss': rss_mib(),
+            'rss_delta': rss_mib() - baseline,
+            'guilds': len(bot.guilds),
+            'members': sum(g.member_count or 0 for g in bot.guilds),
+            'cached_members': sum(len(g.members) for g in bot.guilds),
+            'cached_users': len(bot.users),
+        }
+    finally:
+        await bot.close()
+        task.cancel()
+
+
+def run(profile, results):
+    try:
+        results.put((profile, asyncio.run(measure(profile))))
+    except Exception as e:
+        results.put((profile, {'error': f'{type(e).__name__}: {e}'}))
+
+
+def report(profile, result):
+    if 'error' in result:
+        print(f"  {profile:<8} failed: {result['error']}")
+        return
+
+    print(
+        f"  {profile:<8} ready {result['ready']:>7.2f} s | RSS {result['rss']:>7.1f} MiB "
+        f"(+{result['rss_delta']:.1f} for the bot) | {result['guilds']:>5} guilds | "
+        f"{result['cached_members']:>7}/{result['members']} members cached, {result['cached_users']} users"
+    )
+
+
+def main(profiles):
+    if not os.getenv('DISCORD_BOT_TOKEN'):
+        print('DISCORD_BOT_TOKEN is not set, nothing to benchmark')
+        return
+
+    # One process per profile, so memory freed by an earlier run doesn't hide the difference
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+
+    print('Gateway startup by intents profile')
+    for profile in profiles:
+        process = context.Process(target=run, args=(profile, results))
+        process.start()
+        report(*results.get())
+        process.join()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main(sys.argv[1:] or PROFILES)
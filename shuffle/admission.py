@@ -0,0 +1,264 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from shuffle.metrics import registry
+from shuffle.player.cache import LRUCache
+
+# Extraction priorities, lower runs first
+INTERACTIVE = 0  # A user is waiting on it (play command, track starting)
+BACKGROUND = 1  # Prefetch, playlist expansion, restore
+
+class TokenBucket:
+    """Allows `capacity` requests at once, refilled at `rate` per second"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """Seconds until `cost` tokens are available, 0 if they are now. Takes nothing"""
+        self._refill(time.monotonic())
+
+        if self.tokens >= cost:
+            return 0.0
+
+        return (cost - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def try_acquire(self, cost: float = 1.0) -> float:
+        """Take `cost` tokens, returns 0 on success or the seconds until they would be available"""
+        retry_after = self.wait_time(cost)
+        if not retry_after:
+            self.tokens -= cost
+        return retry_after
+
+
+class RateLimiter:
+    """One token bucket per key (user, guild), idle buckets fall out of a bounded LRU"""
+
+    def __init__(self, rate: float, capacity: float, maxsize: int = 10000) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: LRUCache[TokenBucket] = LRUCache(maxsize=maxsize)
+
+        self.allowed = 0
+        self.limited = 0
+
+    def _bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            self._buckets.set(key, bucket)
+        return bucket
+
+    def wait(self, key: Hashable) -> float:
+        """0 if a request would be allowed, otherwise seconds to wait. Takes no token"""
+        retry_after = self._bucket(key).wait_time()
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+    def check(self, key: Hashable) -> float:
+        """0 if the request is allowed (and takes its token), otherwise seconds to wait"""
+        retry_after = self._bucket(key).try_acquire()
+        if retry_after:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tracked': len(self._buckets),
+            'allowed': self.allowed,
+            'limited': self.limited,
+        }
+
+
+class PrioritySemaphore:
+    """asyncio semaphore that wakes waiters by priority, then in arrival order"""
+
+    def __init__(self, limit: int) -> None:
+        if limit <= 0:
+            raise ValueError('limit must be positive')
+
+        self.limit = limit
+        self._active = 0
+        self._waiters: List[Tuple[int, int, 'asyncio.Future[None]']] = []
+        self._seq = itertools.count()
+
+        self.waited = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    async def acquire(self, priority: int = INTERACTIVE) -> None:
+        # Drop waiters that were cancelled before their turn
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+
+        future: 'asyncio.Future[None]' = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.waited += 1
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Woken and cancelled at the same time, pass the slot on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._active -= 1
+
+        while self._waiters and self._active < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._active += 1
+                future.set_result(None)
+
+
+
+class AdmissionControl:
+    """Rate limits for expensive commands and concurrency caps for extractions.
+
+    Commands are checked against a token bucket per user and per guild before any
+    work is done. Extractions take a slot from a per-guild semaphore and then from the
+    global one, so a single guild can never hold more than `guild_concurrency` of the
+    `max_concurrency` global slots, and interactive requests jump background ones.
+    """
+
+    def __init__(self, max_concurrency: int = 4, guild_concurrency: int = 2,
+                 user_rate: float = 0.2, user_burst: float = 3,
+                 guild_rate: float = 1.0, guild_burst: float = 10) -> None:
+        self.users = RateLimiter(user_rate, user_burst)
+        self.guilds = RateLimiter(guild_rate, guild_burst)
+
+        self.max_concurrency = max_concurrency
+        self.guild_concurrency = min(guild_concurrency, max_concurrency)
+        self._global = PrioritySemaphore(max_concurrency)
+        self._per_guild: Dict[int, PrioritySemaphore] = {}
+
+        # Users already told they are rate limited, until when
+        self._notified: LRUCache[float] = LRUCache(maxsize=10000)
+
+    def admit(self, guild_id: int, user_id: int) -> float:
+        """0 if an expensive command may run, otherwise seconds until it may.
+
+        Tokens are only taken once both the user and the guild allow it, a request the
+        guild turns away doesn't cost the user one.
+        """
+        retry_after = max(self.users.wait(user_id), self.guilds.wait(guild_id))
+        if retry_after:
+            return retry_after
+
+        self.users.check(user_id)
+        self.guilds.check(guild_id)
+        return 0.0
+
+    def should_notify(self, user_id: int, retry_after: float) -> bool:
+        """Tell a limited user once per wait, not on every rejected message"""
+        now = time.monotonic()
+        until = self._notified.get(user_id)
+        if until is not None and until > now:
+            return False
+
+        self._notified.set(user_id, now + retry_after)
+        return True
+
+    async def acquire(self, guild_id: int, priority: int = INTERACTIVE) -> Callable[[], None]:
+        """Wait for an extraction slot, returns the function that gives it back (call it once, on the loop)"""
+        if guild_id not in self._per_guild:
+            self._per_guild[guild_id] = PrioritySemaphore(self.guild_concurrency)
+        guild = self._per_guild[guild_id]
+
+        await guild.acquire(priority)
+        try:
+            await self._global.acquire(priority)
+        except BaseException:
+            self._release_guild(guild_id, guild)
+            raise
+
+        def release() -> None:
+            self._global.release()
+            self._release_guild(guild_id, guild)
+
+        return release
+
+    def _release_guild(self, guild_id: int, guild: PrioritySemaphore) -> None:
+        guild.release()
+
+        # Don't keep a semaphore around for every guild that ever searched
+        if guild.active == 0 and not guild.waiting and self._per_guild.get(guild_id) is guild:
+            del self._per_guild[guild_id]
+
+    def __repr__(self) -> str:
+        return f'AdmissionControl[max_concurrency={self.max_concurrency}, guild_concurrency={self.guild_concurrency}]'
+
+
+_admission: Optional[AdmissionControl] = None
+_admission_lock = threading.Lock()
+
+def get_admission(config: dict) -> AdmissionControl:
+    """Get the process-wide admission control, created from the config on first use"""
+    global _admission
+
+    with _admission_lock:
+        if _admission is None:
+            _admission = AdmissionControl(
+                max_concurrency=config.get('extract_max_concurrency', config.get('ytdl_pool_size', 4)),
+                guild_concurrency=config.get('extract_guild_concurrency', 2),
+                user_rate=config.get('play_user_rate', 0.2),
+                user_burst=config.get('play_user_burst', 3),
+                guild_rate=config.get('play_guild_rate', 1.0),
+                guild_burst=config.get('play_guild_burst', 10)
+            )
+        return _admission
+
+
+def _collect_limiters(key: str) -> List[Tuple[Tuple[str, ...], float]]:
+    if _admission is None:
+        return []
+    return [(('user',), _admission.users.stats[key]), (('guild',), _admission.guilds.stats[key])]
+
+def _collect_extractions(value: Callable[[AdmissionControl], float]) -> Callable[[], List[Tuple[Tuple[str, ...], float]]]:
+    return lambda: [((), value(_admission))] if _admission is not None else []
+
+registry.gauge_callback('shuffle_rate_limit_buckets', 'Token buckets held for recently active keys',
+                        lambda: _collect_limiters('tracked'), ('scope',))
+registry.counter_callback('shuffle_rate_limit_allowed_total', 'Expensive commands a rate limiter let through',
+                          lambda: _collect_limiters('allowed'), ('scope',))
+registry.counter_callback('shuffle_rate_limit_limited_total', 'Expensive commands a rate limiter turned away',
+                          lambda: _collect_limiters('limited'), ('scope',))
+
+registry.gauge_callback('shuffle_extraction_slots', 'Global concurrent extraction cap',
+                        _collect_extractions(lambda a: a.max_concurrency))
+registry.gauge_callback('shuffle_extractions_active', 'Extractions holding a global slot',
+                        _collect_extractions(lambda a: a._global.active))
+registry.gauge_callback('shuffle_extractions_waiting', 'Extractions queued for a global slot',
+                        _collect_extractions(lambda a: a._global.waiting))
+registry.counter_callback('shuffle_extractions_queued_total', 'Extractions that had to wait for a global slot',
+                          _collect_extractions(lambda a: a._global.waited))
@@ -0,0 +1,30 @@
+import random
+
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class Backoff:
+    """Capped exponential backoff with jitter.
+
+    Attempt 0 waits about `base` seconds, each later attempt `factor` times longer,
+    never more than `cap`. `jitter` is the fraction of each delay that is randomized
+    away, so guilds retrying after the same outage don't all retry at once.
+    """
+
+    base: float = 0.5
+    factor: float = 2.0
+    cap: float = 10.0
+    jitter: float = 0.5
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.cap, self.base * self.factor ** max(0, attempt))
+        return delay * (1 - self.jitter * random.random())
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'Backoff':
+        return cls(
+            base=config.get('base', cls.base),
+            factor=config.get('factor', cls.factor),
+            cap=config.get('cap', cls.cap),
+            jitter=min(1.0, max(0.0, config.get('jitter', cls.jitter)))
+        )
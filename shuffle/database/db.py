@@ -0,0 +1,325 @@
+import abc
+import asyncio
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from shuffle.metrics import registry
+
+T = TypeVar('T')
+
+QUERY_SECONDS = registry.histogram(
+    'shuffle_db_transaction_seconds', 'Time a transaction held a pooled connection, including the wait for one', ('backend',)
+)
+QUERY_FAILURES = registry.counter(
+    'shuffle_db_transaction_failures_total', 'Transactions rolled back after an error', ('backend',)
+)
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@functools.lru_cache(maxsize=256)
+def _translate_placeholders(sql: str, placeholder: str) -> str:
+    """Rewrite `?` placeholders for a `format` paramstyle driver.
+
+    Only `?` outside quoted strings and identifiers is a placeholder, and a literal `%`
+    has to be doubled or the driver reads it as the start of one.
+    """
+    if placeholder == '?':
+        return sql
+
+    out = []
+    quote = None
+    escaped = False
+    for c in sql:
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == quote:
+                quote = None
+            out.append('%%' if c == '%' else c)
+        elif c in ('\'', '"', '`'):
+            quote = c
+            out.append(c)
+        elif c == '?':
+            out.append(placeholder)
+        else:
+            out.append('%%' if c == '%' else c)
+    return ''.join(out)
+
+
+class Cursor:
+    """DB-API cursor that takes `?` placeholders whatever the backend"""
+
+    def __init__(self, cursor: Any, placeholder: str) -> None:
+        self._cursor = cursor
+        self._placeholder = placeholder
+
+    def _sql(self, sql: str) -> str:
+        return _translate_placeholders(sql, self._placeholder)
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> 'Cursor':
+        self._cursor.execute(self._sql(sql), tuple(params))
+        return self
+
+    def executemany(self, sql: str, rows: Iterable[Sequence[Any]]) -> 'Cursor':
+        self._cursor.executemany(self._sql(sql), [tuple(r) for r in rows])
+        return self
+
+    def fetchone(self) -> Optional[Sequence[Any]]:
+        return self._cursor.fetchone()
+
+    def fetchall(self) -> List[Sequence[Any]]:
+        return self._cursor.fetchall()
+
+    @property
+    def lastrowid(self) -> int:
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+
+class Database(abc.ABC):
+    """Async access to a pool of blocking DB-API connections.
+
+    Queries run on a dedicated thread pool sized to the connection pool, each call
+    borrows a connection for the length of one transaction. Backends only provide
+    `_connect` and their SQL dialect.
+    """
+
+    placeholder = '?'
+
+    def __init__(self, pool_size: int = 4, name: str = 'db', logger: Optional[logging.Logger] = None) -> None:
+        if pool_size <= 0:
+            raise ValueError('pool size must be positive')
+
+        self.name = name
+        self.pool_size = pool_size
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=f'db-{name}')
+        self._idle: 'queue.LifoQueue[Any]' = queue.LifoQueue()
+        self._connections = 0
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _connect(self) -> Any:
+        """Open a new DB-API connection"""
+
+    def _check(self, conn: Any) -> Any:
+        """Called on a pooled connection before reuse, returns a usable connection"""
+        return conn
+
+    def _acquire(self) -> Any:
+        try:
+            return self._check(self._idle.get_nowait())
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._connections < self.pool_size
+            if create:
+                self._connections += 1
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._connections -= 1
+                raise
+
+        return self._check(self._idle.get())
+
+    def _release(self, conn: Any) -> None:
+        self._idle.put(conn)
+
+    def _transaction(self, fn: Callable[[Cursor], T]) -> T:
+        started_at = time.monotonic()
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor()
+            try:
+                result = fn(Cursor(cursor, self.placeholder))
+            finally:
+                cursor.close()
+            conn.commit()
+            return result
+        except Exception:
+            QUERY_FAILURES.inc(self.name)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            self._release(conn)
+            QUERY_SECONDS.observe(time.monotonic() - started_at, self.name)
+
+    async def run(self, fn: Callable[[Cursor], T]) -> T:
+        """Run fn(cursor) in one transaction on the pool, committed if it returns"""
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._transaction, fn)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Run one statement, returns the last inserted row id"""
+        return await self.run(lambda cur: cur.execute(sql, params).lastrowid)
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence[Any]]) -> None:
+        rows = list(rows)
+        await self.run(lambda cur: cur.executemany(sql, rows))
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[Sequence[Any]]:
+        return await self.run(lambda cur: cur.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[Sequence[Any]]:
+        return await self.run(lambda cur: cur.execute(sql, params).fetchall())
+
+    @abc.abstractmethod
+    def upsert_sql(self, table: str, columns: Sequence[str], keys: Sequence[str], update: Sequence[str]) -> str:
+        """INSERT that overwrites `update` columns when a row with the same `keys` exists"""
+
+    @abc.abstractmethod
+    def insert_ignore_sql(self, table: str, columns: Sequence[str]) -> str:
+        """INSERT that skips rows whose key already exists"""
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}[name={self.name}, pool_size={self.pool_size}]'
+
+
+class SQLiteDatabase(Database):
+    """Local and test backend, the schema is created on first connect"""
+
+    def __init__(self, path: str, pool_size: int = 2, logger: Optional[logging.Logger] = None) -> None:
+        super().__init__(pool_size=pool_size, name='sqlite', logger=logger)
+        self.path = path
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self) -> Any:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Connections are handed between pool threads, but only ever used by one at a time
+        conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+
+        # Held while the schema is created, so no other connection sees a half-built database
+        with self._schema_lock:
+            if not self._schema_ready:
+                with open(os.path.join(SCHEMA_DIR, 'schema.sqlite.sql'), 'r') as f:
+                    conn.executescript(f.read())
+                self._schema_ready = True
+
+        return conn
+
+    def upsert_sql(self, table: str, columns: Sequence[str], keys: Sequence[str], update: Sequence[str]) -> str:
+        return (
+            f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)}) '
+            f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in update)}'
+        )
+
+    def insert_ignore_sql(self, table: str, columns: Sequence[str]) -> str:
+        return f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+
+
+class MySQLDatabase(Database):
+    """Production backend, the schema is applied by the database container (schema.sql)"""
+
+    placeholder = '%s'
+
+    def __init__(self, host: str, user: str, password: str, database: str, port: int = 3306,
+                 pool_size: int = 4, logger: Optional[logging.Logger] = None) -> None:
+        super().__init__(pool_size=pool_size, name='mysql', logger=logger)
+
+        try:
+            import mysql.connector # type: ignore
+        except ImportError:
+            raise Exception('mysql-connector-python is required for the mysql database backend')
+
+        self._mysql = mysql.connector
+        self._params = dict(host=host, port=port, user=user, password=password, database=database)
+
+    def _connect(self) -> Any:
+        return self._mysql.connect(autocommit=False, **self._params)
+
+    def _check(self, conn: Any) -> Any:
+        # Idle connections get dropped by the server after wait_timeout
+        conn.ping(reconnect=True, attempts=2, delay=0)
+        return conn
+
+    def upsert_sql(self, table: str, columns: Sequence[str], keys: Sequence[str], update: Sequence[str]) -> str:
+        return (
+            f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)}) '
+            f'ON DUPLICATE KEY UPDATE {", ".join(f"{c} = VALUES({c})" for c in update)}'
+        )
+
+    def insert_ignore_sql(self, table: str, columns: Sequence[str]) -> str:
+        return f'INSERT IGNORE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+
+
+_databases: Dict[str, Database] = {}
+_databases_lock = threading.Lock()
+
+def get_database(config: dict, logger: Optional[logging.Logger] = None) -> Optional[Database]:
+    """Get the process-wide database for the configured backend, None if there is none"""
+    db_config = config.get('database')
+    if not db_config:
+        return None
+
+    backend = db_config.get('backend', 'sqlite')
+    with _databases_lock:
+        if backend not in _databases:
+            if backend == 'sqlite':
+                _databases[backend] = SQLiteDatabase(
+                    db_config['path'],
+                    pool_size=db_config.get('pool_size', 2),
+                    logger=logger
+                )
+            elif backend == 'mysql':
+                _databases[backend] = MySQLDatabase(
+                    host=db_config.get('host', 'localhost'),
+                    port=db_config.get('port', 3306),
+                    user=db_config.get('user', 'shuffle'),
+                    password=os.getenv('SHUFFLE_DB_PASSWORD', db_config.get('password', '')),
+                    database=db_config.get('name', 'shuffle'),
+                    pool_size=db_config.get('pool_size', 4),
+                    logger=logger
+                )
+            else:
+                raise Exception(f'Unknown database backend: {backend}')
+        return _databases[backend]
+
+
+def _collect(value: Callable[[Database], float]) -> Callable[[], List[Tuple[Tuple[str, ...], float]]]:
+    def collect() -> List[Tuple[Tuple[str, ...], float]]:
+        with _databases_lock:
+            databases = list(_databases.values())
+        return [((db.name,), value(db)) for db in databases]
+    return collect
+
+registry.gauge_callback('shuffle_db_pool_size', 'Connections a database pool may open',
+                        _collect(lambda db: db.pool_size), ('backend',))
+registry.gauge_callback('shuffle_db_connections', 'Connections opened by a database pool',
+                        _collect(lambda db: db._connections), ('backend',))
+registry.gauge_callback('shuffle_db_connections_idle', 'Open connections not in a transaction',
+                        _collect(lambda db: db._idle.qsize()), ('backend',))
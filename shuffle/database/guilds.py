@@ -0,0 +1,148 @@
+import logging
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from shuffle.database.db import Cursor, Database
+from shuffle.player.models.Guild import Guild
+from shuffle.player.singleflight import SingleFlight
+
+# Settings stored in guild_stats, `prefix` lives in guild
+LIMITS = ('track_max_duration_min', 'track_max_count', 'track_max_storage')
+
+PREFIX_MAX_LENGTH = 5
+
+class GuildConfigs:
+    """Per-guild settings, loaded from the database on first use and kept in memory.
+
+    `prefixes` mirrors the cached guilds' prefixes in a plain dict, so checking a
+    message against its guild's prefix is one lookup. Entries are only dropped when
+    the cache is full (oldest loaded first) or when invalidated after a change.
+    """
+
+    def __init__(self, config: dict, db: Optional[Database] = None, maxsize: int = 10000,
+                 logger: Optional[logging.Logger] = None) -> None:
+        self.config = config
+        self.db = db
+        self.maxsize = maxsize
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.prefixes: Dict[int, str] = {}
+        self._guilds: Dict[int, Guild] = {}
+        self._loading: SingleFlight[Guild] = SingleFlight()
+
+        self.loads = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def default_prefix(self) -> str:
+        return self.config.get('prefix', '!')
+
+    def _default(self, guild_id: int) -> Guild:
+        return Guild(
+            guild_id,
+            prefix=self.default_prefix,
+            track_max_duration_min=self.config.get('track_max_duration_min', 15),
+            track_max_count=self.config.get('track_max_count', 1000),
+            track_max_storage=self.config.get('track_max_storage', 10)
+        )
+
+    def cached(self, guild_id: int) -> Optional[Guild]:
+        return self._guilds.get(guild_id)
+
+    async def get(self, guild_id: int) -> Guild:
+        guild = self._guilds.get(guild_id)
+        if guild is not None:
+            return guild
+
+        return await self._loading.do(guild_id, lambda: self._load(guild_id))
+
+    async def _load(self, guild_id: int) -> Guild:
+        guild = self._default(guild_id)
+        self.loads += 1
+
+        if self.db is not None:
+            try:
+                await self.db.run(lambda cur: self._read(cur, guild))
+            except Exception as e:
+                # Defaults keep the bot usable, the next invalidation retries
+                self.logger.error(f'Failed to load settings for guild {guild_id}: {str(e)}')
+
+        self._store(guild)
+        return guild
+
+    def _read(self, cur: Cursor, guild: Guild) -> None:
+        row = cur.execute('SELECT prefix FROM guild WHERE guild_id = ?', (guild.id,)).fetchone()
+        if row is not None:
+            guild.prefix = row[0]
+
+        row = cur.execute(
+            f'SELECT {", ".join(LIMITS)} FROM guild_stats WHERE guild_id = ?', (guild.id,)
+        ).fetchone()
+        if row is not None:
+            for name, value in zip(LIMITS, row):
+                setattr(guild, name, value)
+
+    def _store(self, guild: Guild) -> None:
+        if guild.id not in self._guilds and len(self._guilds) >= self.maxsize:
+            oldest = next(iter(self._guilds))
+            del self._guilds[oldest]
+            del self.prefixes[oldest]
+            self.evictions += 1
+
+        self._guilds[guild.id] = guild
+        self.prefixes[guild.id] = guild.prefix
+
+    def invalidate(self, guild_id: Optional[int] = None) -> None:
+        """Drop cached settings for one guild (or all), they are reloaded on next use"""
+        if guild_id is None:
+            self._guilds.clear()
+            self.prefixes.clear()
+        else:
+            self._guilds.pop(guild_id, None)
+            self.prefixes.pop(guild_id, None)
+        self.invalidations += 1
+
+    async def update(self, guild_id: int, **settings: Any) -> Guild:
+        """Persist changed settings, then invalidate so every reader picks them up"""
+        unknown = set(settings) - {'prefix', *LIMITS}
+        if unknown:
+            raise ValueError(f'Unknown guild settings: {", ".join(sorted(unknown))}')
+
+        prefix = settings.get('prefix')
+        if prefix is not None and (not 0 < len(prefix) <= PREFIX_MAX_LENGTH or any(c.isspace() for c in prefix)):
+            raise ValueError(f'Prefix must be 1 to {PREFIX_MAX_LENGTH} characters without spaces')
+
+        guild = await self.get(guild_id)
+
+        if self.db is not None:
+            db = self.db
+            limits = {name: settings.get(name, getattr(guild, name)) for name in LIMITS}
+            now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+            def write(cur: Cursor) -> None:
+                if prefix is not None:
+                    cur.execute(
+                        db.upsert_sql('guild', ('guild_id', 'prefix', 'created_at', 'updated_at'),
+                                      ('guild_id',), ('prefix', 'updated_at')),
+                        (guild_id, prefix, now, now)
+                    )
+                if any(name in settings for name in LIMITS):
+                    cur.execute(
+                        db.upsert_sql('guild_stats', ('guild_id', *LIMITS), ('guild_id',), LIMITS),
+                        (guild_id, *limits.values())
+                    )
+
+            await db.run(write)
+            self.invalidate(guild_id)
+            return await self.get(guild_id)
+
+        # No database, settings only last until restart
+        for name, value in settings.items():
+            setattr(guild, name, value)
+        self.prefixes[guild_id] = guild.prefix
+        return guild
+
+    def __repr__(self) -> str:
+        return f'GuildConfigs[size={len(self._guilds)}]'
@@ -0,0 +1,111 @@
+
+-- SQLite version of schema.sql for local runs and tests, keep the two in sync
+-- ENUM columns are TEXT with CHECK constraints, AUTO_INCREMENT keys are INTEGER PRIMARY KEY
+
+-- Store data per guild
+CREATE TABLE IF NOT EXISTS guild (
+    guild_id INTEGER NOT NULL PRIMARY KEY,
+    prefix TEXT NOT NULL DEFAULT '!',
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS guild_stats (
+    guild_id INTEGER NOT NULL PRIMARY KEY,
+    track_count INTEGER NOT NULL DEFAULT 0,
+    track_storage INTEGER NOT NULL DEFAULT 0,
+    track_max_duration_min INTEGER NOT NULL DEFAULT 15,
+    track_max_count INTEGER NOT NULL DEFAULT 1000,
+    track_max_storage INTEGER NOT NULL DEFAULT 10
+);
+
+CREATE TABLE IF NOT EXISTS guild_roles (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    role_name TEXT NOT NULL,
+    role_type TEXT NOT NULL CHECK (role_type IN ('admin', 'dj', 'user')),
+    PRIMARY KEY (guild_id, role_id)
+);
+
+CREATE TABLE IF NOT EXISTS guild_role_permissions (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    permission TEXT NOT NULL,
+    PRIMARY KEY (guild_id, role_id, permission)
+);
+
+CREATE TABLE IF NOT EXISTS guild_messages (
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    message_type TEXT NOT NULL DEFAULT 'status' CHECK (message_type IN ('status')),
+    message_text TEXT NOT NULL DEFAULT 'empty',
+    PRIMARY KEY (guild_id, message_id)
+);
+
+CREATE TABLE IF NOT EXISTS guild_users (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    discord_id INTEGER NOT NULL,
+    user_name TEXT NOT NULL,
+    role_id INTEGER NOT NULL,
+    UNIQUE (guild_id, discord_id)
+);
+
+
+-- Track data
+CREATE TABLE IF NOT EXISTS track (
+    track_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active' CHECK (status IN ('active', 'inactive')),
+    stored TEXT NOT NULL DEFAULT 'no' CHECK (stored IN ('yes', 'no')),
+    type TEXT NOT NULL CHECK (type IN ('youtube')),
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS track_youtube (
+    track_id INTEGER NOT NULL,
+    youtube_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    youtube_hash TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL DEFAULT 0,
+    duration INTEGER NOT NULL,
+    query TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS track_youtube_track_id ON track_youtube (track_id);
+
+CREATE TABLE IF NOT EXISTS track_plays (
+    play_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    track_id INTEGER NOT NULL,
+    played_at DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS track_plays_guild_played ON track_plays (guild_id, played_at);
+CREATE INDEX IF NOT EXISTS track_plays_track_id ON track_plays (track_id);
+
+
+-- Queue data, checkpointed by the snapshot store so queues survive a restart
+CREATE TABLE IF NOT EXISTS queue (
+    guild_id INTEGER NOT NULL UNIQUE,
+    queue_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL DEFAULT 'waiting' CHECK (status IN ('waiting', 'playing', 'dead')),
+    event TEXT NOT NULL DEFAULT 'none' CHECK (event IN ('none', 'play', 'pause', 'stop')),
+    position REAL NOT NULL DEFAULT 0,
+    history_length INTEGER NOT NULL DEFAULT 100,
+    queue_length INTEGER NOT NULL DEFAULT 100,
+    created_at DATETIME,
+    updated_at DATETIME
+);
+
+CREATE TABLE IF NOT EXISTS queue_tracks (
+    queue_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    source_id TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT 'youtube',
+    title TEXT NOT NULL,
+    query TEXT NOT NULL,
+    web_url TEXT NOT NULL,
+    duration INTEGER NOT NULL DEFAULT -1,
+    channel_id INTEGER,
+    PRIMARY KEY (queue_id, position)
+);
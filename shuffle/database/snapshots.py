@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import logging
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from shuffle.database.db import Cursor, Database, get_database
+from shuffle.database.stats import NAME_LENGTH, QUERY_LENGTH
+from shuffle.metrics import registry
+
+@dataclass
+class TrackSnapshot:
+    id: str
+    title: str
+    query: str
+    web_url: str
+    duration: int = -1
+    source: str = 'youtube'
+    channel_id: Optional[int] = None
+
+
+@dataclass
+class QueueSnapshot:
+    guild_id: int
+    status: str = 'waiting'  # 'waiting', 'playing'
+    event: str = 'none'  # 'none', 'play', 'pause', 'stop'
+    position: float = 0.0  # Seconds into the current track
+    current: Optional[TrackSnapshot] = None
+    tracks: List[TrackSnapshot] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return self.current is None and not self.tracks
+
+
+class SnapshotStore:
+    """Checkpoints player queues to the queue / queue_tracks tables so a restart can pick up where it left off.
+
+    Players mark themselves dirty on every change, the store waits `delay` seconds to
+    coalesce bursts (a playlist load is hundreds of changes) and then writes the latest
+    snapshot of each dirty guild in one transaction. Writes run one after another and
+    loads wait for the writes before them, so a guild never reads an older checkpoint
+    than the last one taken.
+    """
+
+    def __init__(self, db: Database, delay: float = 2.0, logger: Optional[logging.Logger] = None) -> None:
+        self.db = db
+        self.delay = delay
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._dirty: Dict[int, Callable[[], Optional[QueueSnapshot]]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._writing: Optional['asyncio.Task[None]'] = None
+
+        self.marked = 0
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def mark_dirty(self, guild_id: int, snapshot: Callable[[], Optional[QueueSnapshot]]) -> None:
+        """Schedule a checkpoint, `snapshot` is called on the loop once the delay has passed"""
+        self._dirty[guild_id] = snapshot
+        self.marked += 1
+
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.delay, self._flush_dirty)
+
+    def _flush_dirty(self) -> 'asyncio.Task[None]':
+        self._flush_handle = None
+
+        dirty, self._dirty = self._dirty, {}
+        snapshots: Dict[int, Optional[QueueSnapshot]] = {}
+        for guild_id, snapshot in dirty.items():
+            try:
+                snapshots[guild_id] = snapshot()
+            except Exception as e:
+                self.logger.error(f'Failed to snapshot guild {guild_id}: {str(e)}')
+
+        # Queued behind the previous write, so an older snapshot never lands after a newer one
+        self._writing = asyncio.get_event_loop().create_task(self._write_after(self._writing, snapshots))
+        return self._writing
+
+    async def _write_after(self, previous: Optional['asyncio.Task[None]'],
+                           snapshots: Dict[int, Optional[QueueSnapshot]]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        if not snapshots:
+            return
+
+        try:
+            await self.db.run(lambda cur: self._write(cur, snapshots))
+            self.written += len(snapshots)
+            self.flushes += 1
+        except Exception as e:
+            self.failures += 1
+            self.logger.error(f'Failed to write queue snapshots: {str(e)}')
+
+    async def _settled(self) -> None:
+        """Wait for the writes started so far"""
+        if self._writing is not None:
+            await asyncio.wait([self._writing])
+
+    async def flush(self) -> None:
+        """Write everything still pending right away, e.g. before a restart"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+
+        await asyncio.wait([self._flush_dirty()])
+
+    def _write(self, cur: Cursor, snapshots: Dict[int, Optional[QueueSnapshot]]) -> None:
+        """Replace the dirty guilds' queues, runs on a pool thread inside one transaction"""
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        upsert = self.db.upsert_sql(
+            'queue', ('guild_id', 'status', 'event', 'position', 'created_at', 'updated_at'),
+            ('guild_id',), ('status', 'event', 'position', 'updated_at')
+        )
+
+        for guild_id, snapshot in snapshots.items():
+            row = cur.execute('SELECT queue_id FROM queue WHERE guild_id = ?', (guild_id,)).fetchone()
+            if row is not None:
+                cur.execute('DELETE FROM queue_tracks WHERE queue_id = ?', (row[0],))
+
+            if snapshot is None or snapshot.is_empty:
+                cur.execute('DELETE FROM queue WHERE guild_id = ?', (guild_id,))
+                continue
+
+            cur.execute(upsert, (guild_id, snapshot.status, snapshot.event, snapshot.position, now, now))
+            if row is None:
+                row = cur.execute('SELECT queue_id FROM queue WHERE guild_id = ?', (guild_id,)).fetchone()
+            queue_id = row[0] if row is not None else None
+
+            # Position 0 is the current track, the queue follows from 1
+            rows: List[Tuple[int, TrackSnapshot]] = []
+            if snapshot.current is not None:
+                rows.append((0, snapshot.current))
+            rows.extend((i + 1, t) for i, t in enumerate(snapshot.tracks))
+
+            cur.executemany(
+                'INSERT INTO queue_tracks '
+                '(queue_id, position, source_id, source, title, query, web_url, duration, channel_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(queue_id, pos, t.id, t.source, t.title[:NAME_LENGTH], t.query[:QUERY_LENGTH], t.web_url,
+                  t.duration, t.channel_id) for pos, t in rows]
+            )
+
+    async def load(self, guild_id: int) -> Optional[QueueSnapshot]:
+        await self._settled()
+        return await self.db.run(lambda cur: self._read(cur, guild_id))
+
+    def _read(self, cur: Cursor, guild_id: int) -> Optional[QueueSnapshot]:
+        row = cur.execute(
+            'SELECT queue_id, status, event, position FROM queue WHERE guild_id = ?', (guild_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        queue_id, status, event, position = row
+        snapshot = QueueSnapshot(guild_id=guild_id, status=status, event=event, position=float(position))
+        for pos, id, source, title, query, web_url, duration, channel_id in cur.execute(
+            'SELECT position, source_id, source, title, query, web_url, duration, channel_id '
+            'FROM queue_tracks WHERE queue_id = ? ORDER BY position', (queue_id,)
+        ).fetchall():
+            track = TrackSnapshot(id=id, title=title, query=query, web_url=web_url, duration=duration,
+                                  source=source, channel_id=channel_id)
+            if pos == 0:
+                snapshot.current = track
+            else:
+                snapshot.tracks.append(track)
+
+        return snapshot
+
+    async def playing_guilds(self) -> List[int]:
+        """Guilds that were playing when the snapshot was taken"""
+        await self._settled()
+        rows = await self.db.fetchall("SELECT guild_id FROM queue WHERE status = 'playing'")
+        return [row[0] for row in rows]
+
+    def __repr__(self) -> str:
+        return f'SnapshotStore[db={self.db}]'
+
+
+_store: Optional[SnapshotStore] = None
+_store_lock = threading.Lock()
+
+def get_snapshot_store(config: dict, logger: Optional[logging.Logger] = None) -> Optional[SnapshotStore]:
+    """Get the process-wide snapshot store, None if snapshots are off or no database is configured"""
+    global _store
+
+    if not config.get('snapshots', True):
+        return None
+
+    db = get_database(config, logger=logger)
+    if db is None:
+        return None
+
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore(db, delay=config.get('snapshot_delay', 2.0), logger=logger)
+        return _store
+
+
+def _collect(value: Callable[[SnapshotStore], float]) -> Callable[[], List[Tuple[Tuple[str, ...], float]]]:
+    return lambda: [((), value(_store))] if _store is not None else []
+
+registry.gauge_callback('shuffle_snapshots_dirty', 'Guilds with a checkpoint waiting for the next write',
+                        _collect(lambda s: len(s._dirty)))
+registry.counter_callback('shuffle_snapshots_marked_total', 'Queue changes that asked for a checkpoint',
+                          _collect(lambda s: s.marked))
+registry.counter_callback('shuffle_snapshots_written_total', 'Guild checkpoints written',
+                          _collect(lambda s: s.written))
+registry.counter_callback('shuffle_snapshots_flushes_total', 'Checkpoint transactions written',
+                          _collect(lambda s: s.flushes))
+registry.counter_callback('shuffle_snapshots_failures_total', 'Checkpoint transactions that failed',
+                          _collect(lambda s: s.failures))
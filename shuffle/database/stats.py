@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import logging
+
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from shuffle.database.db import Cursor, Database, get_database
+from shuffle.metrics import registry
+
+# Column limits in schema.sql
+NAME_LENGTH = 255
+QUERY_LENGTH = 255
+
+@dataclass
+class PlayRecord:
+    guild_id: int
+    youtube_hash: str
+    title: str
+    query: str
+    duration: int
+    played_at: str
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class StatsWriter:
+    """Write-behind recorder for track and play statistics.
+
+    `record_play` only appends to an in-memory buffer, so the command path and the
+    voice thread never wait on the database. Buffered plays are written in batches
+    once `batch_size` have piled up or `interval` seconds after the first one, one
+    batch at a time. Failed batches are put back and retried with the next one; if
+    the database stays down the oldest plays are dropped past `max_pending`.
+    """
+
+    def __init__(self, db: Database, interval: float = 5.0, batch_size: int = 100,
+                 max_pending: int = 10000, logger: Optional[logging.Logger] = None) -> None:
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._pending: Deque[PlayRecord] = deque(maxlen=max_pending)
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._writing: Optional[asyncio.Task] = None
+
+        self.recorded = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+
+    def record_play(self, guild_id: int, track: Any) -> None:
+        if len(self._pending) == self._pending.maxlen:
+            self.logger.warning('Stats buffer full, dropping the oldest play')
+
+        self._pending.append(PlayRecord(
+            guild_id=guild_id,
+            youtube_hash=track.id,
+            title=track.title[:NAME_LENGTH],
+            query=track.query[:QUERY_LENGTH],
+            duration=max(0, track.duration or 0),
+            played_at=_now()
+        ))
+        self.recorded += 1
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._writing is not None or not self._pending:
+            return
+
+        loop = asyncio.get_event_loop()
+        if len(self._pending) >= self.batch_size:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._flush_handle = loop.call_soon(self._start_write)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.interval, self._start_write)
+
+    def _start_write(self) -> None:
+        self._flush_handle = None
+        if self._writing is not None or not self._pending:
+            return
+
+        self._writing = asyncio.get_event_loop().create_task(self._write_next())
+
+    def _take_batch(self) -> List[PlayRecord]:
+        return [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+    async def _write_next(self) -> None:
+        batch = self._take_batch()
+        try:
+            await self.db.run(lambda cur: self._write_batch(cur, batch))
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failures += 1
+            self.logger.error(f'Failed to write {len(batch)} plays, will retry: {str(e)}')
+
+            # Back to the front, newer plays win if the buffer overflows meanwhile
+            space = (self._pending.maxlen or 0) - len(self._pending)
+            self._pending.extendleft(reversed(batch[-space:] if space > 0 else []))
+        finally:
+            self._writing = None
+
+            # Keep draining while full batches are waiting, otherwise wait for the timer
+            self._schedule()
+
+    def _write_batch(self, cur: Cursor, batch: List[PlayRecord]) -> None:
+        """Upsert the tracks and insert the plays, runs on a pool thread inside one transaction"""
+        hashes = list({p.youtube_hash: p for p in batch}.items())
+
+        track_ids: Dict[str, int] = {}
+        cur.execute(
+            f'SELECT youtube_hash, track_id FROM track_youtube WHERE youtube_hash IN ({", ".join("?" for _ in hashes)})',
+            [h for h, _ in hashes]
+        )
+        for youtube_hash, track_id in cur.fetchall():
+            track_ids[youtube_hash] = track_id
+
+        now = _now()
+        for youtube_hash, play in hashes:
+            if youtube_hash in track_ids:
+                continue
+
+            cur.execute(
+                "INSERT INTO track (name, type, created_at, updated_at) VALUES (?, 'youtube', ?, ?)",
+                (play.title, now, now)
+            )
+            track_ids[youtube_hash] = cur.lastrowid
+            cur.execute(
+                'INSERT INTO track_youtube (track_id, youtube_hash, duration, query) VALUES (?, ?, ?, ?)',
+                (track_ids[youtube_hash], youtube_hash, play.duration, play.query)
+            )
+
+        cur.executemany(
+            'INSERT INTO track_plays (guild_id, track_id, played_at) VALUES (?, ?, ?)',
+            [(p.guild_id, track_ids[p.youtube_hash], p.played_at) for p in batch]
+        )
+
+    async def flush(self) -> None:
+        """Write everything buffered now, e.g. before a restart"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._writing is not None:
+            await self._writing
+
+        while self._pending:
+            failures = self.failures
+            self._writing = asyncio.get_event_loop().create_task(self._write_next())
+            await self._writing
+            if self.failures > failures:
+                break
+
+    def __repr__(self) -> str:
+        return f'StatsWriter[db={self.db}, pending={len(self._pending)}]'
+
+
+_writer: Optional[StatsWriter] = None
+_writer_lock = threading.Lock()
+
+def get_stats_writer(config: dict, logger: Optional[logging.Logger] = None) -> Optional[StatsWriter]:
+    """Get the process-wide stats writer, None if no database is configured"""
+    global _writer
+
+    if not config.get('stats', True):
+        return None
+
+    db = get_database(config, logger=logger)
+    if db is None:
+        return None
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = StatsWriter(
+                db,
+                interval=config.get('stats_interval', 5.0),
+                batch_size=config.get('stats_batch_size', 100),
+                logger=logger
+            )
+        return _writer
+
+
+def _collect(value: Callable[[StatsWriter], float]) -> Callable[[], List[Tuple[Tuple[str, ...], float]]]:
+    return lambda: [((), value(_writer))] if _writer is not None else []
+
+registry.gauge_callback('shuffle_stats_pending', 'Plays buffered for the next stats batch',
+                        _collect(lambda w: len(w._pending)))
+registry.counter_callback('shuffle_stats_recorded_total', 'Plays recorded by the stats writer',
+                          _collect(lambda w: w.recorded))
+registry.counter_callback('shuffle_stats_written_total', 'Plays written to the database',
+                          _collect(lambda w: w.written))
+registry.counter_callback('shuffle_stats_batches_total', 'Stats batches written',
+                          _collect(lambda w: w.batches))
+registry.counter_callback('shuffle_stats_failures_total', 'Stats batches that failed and were put back',
+                          _collect(lambda w: w.failures))
@@ -0,0 +1,377 @@
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import logging
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import discord
+from discord.ext import commands
+
+from shuffle.backoff import Backoff
+from shuffle.log import shuffle_logger
+
+# Worker exit codes
+EXIT_OK = 0
+EXIT_REBOOT = 75  # Restart command, start a fresh worker right away
+EXIT_CONFIG = 78  # Bad token, restarting won't help
+
+HEARTBEAT_INTERVAL = 10.0
+
+def load_config(env: str) -> dict:
+    with open(f'config/{env}.json', 'r') as f:
+        return json.load(f)
+
+def plan_shards(shard_count: Optional[int], workers: int) -> List[Optional[List[int]]]:
+    """Shard ids of each worker, dealt round robin. [None] is one worker with the shard count left to Discord"""
+    if workers <= 1 and not shard_count:
+        return [None]
+
+    count = shard_count or workers
+    workers = max(1, min(workers, count))
+    return [list(range(i, count, workers)) for i in range(workers)]
+
+
+def bot_options(profile: str = 'minimal') -> Dict[str, Any]:
+    """Gateway intents and cache settings for the bot.
+
+    'minimal' receives only what the commands use: messages (with their content),
+    guilds and voice states, and caches a member only while they are in a voice
+    channel, without chunking guilds on startup. 'full' is everything, with every
+    member of every guild chunked and cached.
+    """
+    if profile == 'full':
+        return {
+            'intents': discord.Intents.all(),
+            'member_cache_flags': discord.MemberCacheFlags.all(),
+            'chunk_guilds_at_startup': True,
+        }
+
+    if profile != 'minimal':
+        raise ValueError(f'Unknown intents profile {profile!r}')
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.messages = True
+    intents.message_content = True
+    intents.voice_states = True  # Finding the author's voice channel, voice connections
+
+    member_cache = discord.MemberCacheFlags.none()
+    member_cache.voice = True
+
+    return {
+        'intents': intents,
+        'member_cache_flags': member_cache,
+        'chunk_guilds_at_startup': False,
+    }
+
+def create_bot(shard_ids: Optional[List[int]], shard_count: Optional[int],
+               profile: str = 'minimal') -> commands.AutoShardedBot:
+    # The cog routes messages with each guild's own prefix, discord.py's command parsing is unused
+    bot = commands.AutoShardedBot(
+        command_prefix='!', help_command=None,
+        shard_ids=shard_ids, shard_count=shard_count,
+        **bot_options(profile)
+    )
+    bot.remove_command('help')
+    return bot
+
+def run_worker(worker_id: int, shard_ids: Optional[List[int]], shard_count: Optional[int], profile: str,
+               env: str, overrides: dict, heartbeats: Any) -> None:
+    """Worker process entry point, runs one bot for its shards until it stops"""
+    sys.exit(asyncio.run(_worker(worker_id, shard_ids, shard_count, profile, env, overrides, heartbeats)))
+
+async def _worker(worker_id: int, shard_ids: Optional[List[int]], shard_count: Optional[int], profile: str,
+                  env: str, overrides: dict, heartbeats: Any) -> int:
+    from shuffle.shuffle import ShuffleBot
+
+    logger = shuffle_logger()
+    logger.info(f'Starting worker {worker_id} for shards {shard_ids if shard_ids is not None else "auto"}...')
+
+    bot = create_bot(shard_ids, shard_count, profile)
+    cog = ShuffleBot(bot, logger, env=env, overrides=overrides)
+    await bot.add_cog(cog)
+
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda: loop.create_task(_stop(bot, cog, logger)))
+
+    beat = loop.create_task(_heartbeat(worker_id, shard_ids, bot, cog, heartbeats))
+    try:
+        await bot.start(os.getenv('DISCORD_BOT_TOKEN', ''))
+    except discord.LoginFailure as e:
+        logger.error(f'Could not log in: {str(e)}')
+        return EXIT_CONFIG
+    finally:
+        beat.cancel()
+        if not bot.is_closed():
+            await _stop(bot, cog, logger)
+
+    if cog.reboot_requested:
+        logger.info('Received a reboot signal. Rebooting the bot...')
+        return EXIT_REBOOT
+
+    return EXIT_OK
+
+async def _stop(bot: commands.AutoShardedBot, cog: Any, logger: logging.Logger) -> None:
+    """Save the queues while the voice clients are still up, closing disconnects them and idles every player"""
+    try:
+        await cog.shutdown()
+    except Exception as e:
+        logger.error(f'Error saving state on shutdown: {str(e)}')
+
+    await bot.close()
+
+async def _heartbeat(worker_id: int, shard_ids: Optional[List[int]], bot: commands.AutoShardedBot, cog: Any,
+                     heartbeats: Any) -> None:
+    while True:
+        latency = bot.latency
+        heartbeats.put({
+            'worker': worker_id,
+            'pid': os.getpid(),
+            'shards': shard_ids,
+            'ready': bot.is_ready(),
+            'latency_ms': round(latency * 1000, 1) if math.isfinite(latency) else None,
+            'guilds': len(bot.guilds),
+            'players': len(cog.players),
+            'voice_clients': len(bot.voice_clients),
+        })
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+@dataclass
+class WorkerState:
+    id: int
+    shard_ids: Optional[List[int]]
+    process: Any = None
+    started_at: float = 0.0
+    restart_at: Optional[float] = None
+    restarts: int = 0
+    failures: int = 0  # Crashes in a row, reset once a worker stays up
+    heartbeat: Dict[str, Any] = field(default_factory=dict)
+    heartbeat_at: Optional[float] = None
+
+
+class Supervisor:
+    """Runs the bot as worker processes, each owning a slice of the shards and their guilds' players.
+
+    Workers are restarted when they exit: right away after a reboot command, with
+    backoff after a crash, and killed and restarted when their heartbeats stop. Their
+    heartbeats are aggregated into a `/health` endpoint.
+    """
+
+    def __init__(self, env: str, config: dict, logger: Optional[logging.Logger] = None) -> None:
+        self.env = env
+        self.config = config
+        self.logger = logger or shuffle_logger('supervisor')
+
+        self.shard_count: Optional[int] = config.get('shard_count')
+        self.backoff = Backoff.from_config(config.get('worker_restart_backoff', {}))
+        self.heartbeat_timeout = config.get('worker_heartbeat_timeout', 120.0)
+        self.stable_after = config.get('worker_stable_after', 60.0)
+        self.intents_profile: str = config.get('intents_profile', 'minimal')
+
+        plan = plan_shards(self.shard_count, config.get('workers', 1))
+        if plan[0] is not None and not self.shard_count:
+            self.shard_count = len(plan)
+        self.workers = [WorkerState(i, shard_ids) for i, shard_ids in enumerate(plan)]
+
+        # Spawned, so workers don't inherit this process' threads (log listener, heartbeat reader)
+        self._context = multiprocessing.get_context('spawn')
+        self._heartbeats = self._context.Queue()
+        self._stopping = False
+        self._server: Any = None
+
+        self.exit_code = 0
+
+    def _overrides(self, worker: WorkerState) -> dict:
+        overrides: Dict[str, Any] = {'metrics_port': self.config.get('metrics_port', 9108) + worker.id}
+
+        # A guild always lands on the same worker, so each keeps its own audio cache (and index)
+        if len(self.workers) > 1 and 'download_path' in self.config:
+            overrides['download_path'] = os.path.join(self.config['download_path'], f'worker-{worker.id}')
+
+        return overrides
+
+    def _start(self, worker: WorkerState) -> None:
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(
+                worker.id, worker.shard_ids, self.shard_count, self.intents_profile, self.env,
+                self._overrides(worker), self._heartbeats
+            ),
+            name=f'shuffle-worker-{worker.id}'
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        worker.heartbeat = {}
+        worker.heartbeat_at = None
+        self.logger.info(f'Started worker {worker.id} (pid {worker.process.pid}) for shards {worker.shard_ids}')
+
+    def _check(self) -> None:
+        now = time.monotonic()
+
+        for worker in self.workers:
+            if worker.process is None:
+                if worker.restart_at is not None and now >= worker.restart_at:
+                    self._start(worker)
+                continue
+
+            code = worker.process.exitcode
+            if code is None:
+                # Alive but stuck (a blocked event loop sends no heartbeats), restart it
+                last = worker.heartbeat_at if worker.heartbeat_at is not None else worker.started_at
+                if now - last > self.heartbeat_timeout:
+                    self.logger.error(f'Worker {worker.id} sent no heartbeat for {now - last:.0f}s, killing it')
+                    worker.process.kill()
+                continue
+
+            worker.process = None
+            worker.restarts += 1
+
+            if code == EXIT_CONFIG:
+                self.logger.error(f'Worker {worker.id} cannot log in, stopping')
+                self.exit_code = 1
+                self.stop()
+                return
+
+            if code == EXIT_REBOOT:
+                worker.failures = 0
+                worker.restart_at = now
+                continue
+
+            if now - worker.started_at > self.stable_after:
+                worker.failures = 0
+            delay = self.backoff.delay(worker.failures)
+            worker.failures += 1
+            worker.restart_at = now + delay
+            self.logger.error(f'Worker {worker.id} exited with code {code}, restarting in {delay:.1f}s')
+
+    def _read_heartbeats(self, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            heartbeat = self._heartbeats.get()
+            if heartbeat is None:
+                return
+            loop.call_soon_threadsafe(self._on_heartbeat, heartbeat)
+
+    def _on_heartbeat(self, heartbeat: Dict[str, Any]) -> None:
+        worker = self.workers[heartbeat['worker']]
+        if worker.process is not None and worker.process.pid == heartbeat['pid']:
+            worker.heartbeat = heartbeat
+            worker.heartbeat_at = time.monotonic()
+
+    def health(self) -> Dict[str, Any]:
+        now = time.monotonic()
+
+        workers = []
+        for worker in self.workers:
+            alive = worker.process is not None and worker.process.exitcode is None
+            workers.append({
+                'worker': worker.id,
+                'shards': worker.shard_ids,
+                'alive': alive,
+                'ready': alive and bool(worker.heartbeat.get('ready')),
+                'pid': worker.process.pid if worker.process is not None else None,
+                'uptime': round(now - worker.started_at) if alive else 0,
+                'restarts': worker.restarts,
+                'heartbeat_age': round(now - worker.heartbeat_at, 1) if worker.heartbeat_at is not None else None,
+                **{k: worker.heartbeat.get(k) for k in ('latency_ms', 'guilds', 'players', 'voice_clients')},
+            })
+
+        ready = sum(1 for w in workers if w['ready'])
+        return {
+            'status': 'ok' if ready == len(workers) else 'degraded' if ready else 'down',
+            'shard_count': self.shard_count,
+            'guilds': sum(w['guilds'] or 0 for w in workers),
+            'players': sum(w['players'] or 0 for w in workers),
+            'voice_clients': sum(w['voice_clients'] or 0 for w in workers),
+            'workers': workers,
+        }
+
+    async def _start_health_server(self) -> None:
+        from aiohttp import web
+
+        async def handle(request: Any) -> Any:
+            health = self.health()
+            return web.json_response(health, status=200 if health['status'] == 'ok' else 503)
+
+        app = web.Application()
+        app.router.add_get('/health', handle)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.config.get('metrics_host', '127.0.0.1'), self.config.get('supervisor_port', 9107)).start()
+        self._server = runner
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    def _terminate(self) -> None:
+        """Ask every worker to stop (they save their queues first), kill the ones that don't"""
+        processes = [w.process for w in self.workers if w.process is not None]
+        for process in processes:
+            if process.exitcode is None:
+                process.terminate()
+
+        deadline = time.monotonic() + self.config.get('worker_stop_timeout', 20.0)
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.exitcode is None:
+                self.logger.error(f'Worker pid {process.pid} did not stop, killing it')
+                process.kill()
+                process.join()
+
+        self._heartbeats.put(None)
+
+    async def run(self) -> int:
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        threading.Thread(target=self._read_heartbeats, args=(loop,), name='heartbeats', daemon=True).start()
+
+        if self.config.get('supervisor_health', True):
+            try:
+                await self._start_health_server()
+            except Exception as e:
+                self.logger.error(f'Could not start health server: {str(e)}')
+
+        for worker in self.workers:
+            self._start(worker)
+
+        while not self._stopping:
+            self._check()
+            await asyncio.sleep(1.0)
+
+        self.logger.info('Stopping workers')
+        await loop.run_in_executor(None, self._terminate)
+        if self._server is not None:
+            await self._server.cleanup()
+
+        return self.exit_code
+
+
+def main() -> None:
+    env = os.getenv('SHUFFLE_ENV', 'dev')
+    logger = shuffle_logger('supervisor')
+
+    if not os.getenv('DISCORD_BOT_TOKEN'):
+        logger.error('DISCORD_BOT_TOKEN is not set')
+        sys.exit(1)
+
+    try:
+        config = load_config(env)
+        bot_options(config.get('intents_profile', 'minimal'))
+    except Exception as e:
+        logger.error(f'Error loading config for {env}: {str(e)}')
+        sys.exit(1)
+
+    sys.exit(asyncio.run(Supervisor(env, config, logger=logger).run()))
@@ -1,15 +1,126 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 
-def shuffle_logger(name='shuffle'):
-    logger = logging.getLogger(name)
+from typing import Any, Dict, List, Optional, Set
+
+ROOT = 'shuffle'
+
+TEXT_FORMAT = '%(asctime)s - %(name)s [%(levelname)s] |   %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line. Structured records pass `extra={'fields': {...}}`, which replaces the message"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+        }
+
+        guild = getattr(record, 'guild', None)
+        if guild is not None:
+            data['guild'] = guild
+
+        fields = getattr(record, 'fields', None)
+        if isinstance(fields, dict):
+            data.update(fields)
+        else:
+            data['message'] = record.getMessage()
+
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handlers: List[logging.Handler] = []
+_configured: Set[str] = set()
+_lock = threading.Lock()
+
+def _log_path() -> str:
+    return '/var/log/shuffle/out.log' if os.getenv('SHUFFLE_ENV') != 'local' else './out.log'
+
+def _start() -> None:
+    """Attach one queue handler to the 'shuffle' logger, a listener thread does the writing"""
+    global _listener
+
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = [
+        logging.FileHandler(_log_path(), encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        _handlers.append(handler)
+
+    # Callers (the event loop, audio and pool threads) only pay for an enqueue
+    records: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+
+    logger = logging.getLogger(ROOT)
     logger.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s - %(name)s [%(levelname)s] |   %(message)s')
-    file_handle = logging.FileHandler('/var/log/shuffle/out.log' if os.getenv('SHUFFLE_ENV') != 'local' else './out.log', encoding='utf-8')
-    file_handle.setFormatter(formatter)
-    logger.addHandler(file_handle)
-    console_handle = logging.StreamHandler()
-    console_handle.setFormatter(formatter)
-    logger.addHandler(console_handle)
-
-    return logger
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+    # Drain what is still queued on the way out
+    atexit.register(_listener.stop)
+
+def shuffle_logger(name: str = ROOT) -> logging.Logger:
+    """Get a logger under 'shuffle', all of them share the process' one set of handlers"""
+    with _lock:
+        _start()
+
+    if name != ROOT and not name.startswith(f'{ROOT}.'):
+        name = f'{ROOT}.{name}'
+    return logging.getLogger(name)
+
+class GuildLogger(logging.LoggerAdapter):
+    """A shared logger that tags each record with a guild, in the text and as `guild` in JSON"""
+
+    def __init__(self, logger: logging.Logger, guild_id: int) -> None:
+        super().__init__(logger, {'guild': guild_id})
+        self.guild_id = guild_id
+
+    def process(self, msg: Any, kwargs: Any) -> Any:
+        kwargs['extra'] = {'guild': self.guild_id, **kwargs.get('extra', {})}
+        return f'[{self.guild_id}] {msg}', kwargs
+
+def guild_logger(name: str, guild_id: int) -> GuildLogger:
+    """Per-guild logging without a logger per guild, those are never freed"""
+    return GuildLogger(shuffle_logger(name), guild_id)
+
+def configure_logging(config: dict) -> None:
+    """Apply the log format and levels from the config, again on every restart.
+
+    `log_level` is the default, `log_levels` overrides it per logger ("player",
+    "youtube", "ytdl_pool.search", ...) and applies to that logger's children too.
+    """
+    with _lock:
+        _start()
+
+        formatter = JsonFormatter() if config.get('log_format', 'text') == 'json' else logging.Formatter(TEXT_FORMAT)
+        for handler in _handlers:
+            handler.setFormatter(formatter)
+
+        logging.getLogger(ROOT).setLevel(str(config.get('log_level', 'DEBUG')).upper())
+
+        # Loggers no longer listed go back to inheriting the default
+        levels = {f'{ROOT}.{name}': str(level).upper() for name, level in config.get('log_levels', {}).items()}
+        for name in _configured - set(levels):
+            logging.getLogger(name).setLevel(logging.NOTSET)
+        for name, level in levels.items():
+            logging.getLogger(name).setLevel(level)
+
+        _configured.clear()
+        _configured.update(levels)
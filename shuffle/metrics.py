@@ -0,0 +1,317 @@
+import asyncio
+import bisect
+import threading
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Seconds, tuned for command handling: most commands answer in tens of ms, searches take seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Fixed-bucket histogram, cheap to observe and to export in Prometheus format.
+
+    `buckets` are upper bounds, observations above the last one go to the +Inf bucket.
+    Percentiles are estimated by linear interpolation inside the matching bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._counts: List[int] = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """(upper bound, observations <= bound) pairs, ending with +Inf"""
+        with self._lock:
+            counts = list(self._counts)
+
+        total = 0
+        result = []
+        for bound, count in zip((*self.buckets, float('inf')), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            counts = list(self._counts)
+            count = self._count
+
+        if count == 0:
+            return 0.0
+
+        rank = count * pct / 100
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+
+        return self.buckets[-1]
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'count': self._count,
+            'avg': self._sum / self._count if self._count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+    def __repr__(self) -> str:
+        return f'Histogram[count={self._count}]'
+
+
+Labels = Tuple[str, ...]
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Incremented directly, or read at scrape time from totals an object already keeps via `collect`"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Iterable[Tuple[Labels, float]]]] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        if self.collect is not None:
+            values = list(self.collect())
+        else:
+            with self._lock:
+                values = list(self._values.items()) or ([((), 0.0)] if not self.labelnames else [])
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in values]
+
+
+class Gauge:
+    """Set directly, or computed at scrape time by `collect` returning (labels, value) pairs"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Iterable[Tuple[Labels, float]]]] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> List[str]:
+        if self.collect is not None:
+            values = list(self.collect())
+        else:
+            with self._lock:
+                values = list(self._values.items()) or ([((), 0.0)] if not self.labelnames else [])
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in values]
+
+
+class HistogramFamily:
+    """Histograms split by label values, each child is a plain Histogram"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Labels, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labels: str) -> Histogram:
+        child = self._children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labels, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float, *labels: str) -> None:
+        self.labels(*labels).observe(value)
+
+    def add(self, histogram: Histogram, *labels: str) -> None:
+        """Export an existing histogram under these labels"""
+        with self._lock:
+            self._children[labels] = histogram
+
+    def children(self) -> List[Tuple[Labels, Histogram]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        children = self.children()
+
+        lines = []
+        for labels, histogram in children:
+            for bound, count in histogram.cumulative():
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(histogram.sum)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {histogram.count}')
+        return lines
+
+
+Metric = Union[Counter, Gauge, HistogramFamily]
+
+class Registry:
+    """Named metrics, rendered in the Prometheus text exposition format.
+
+    Getters are idempotent, so modules declare their metrics at import time and
+    objects rebuilt on restart (the cog, players) pick up the same ones.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, factory: Callable[[], Metric]) -> Any:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(name, lambda: Counter(name, help, labelnames))
+
+    def counter_callback(self, name: str, help: str, collect: Callable[[], Iterable[Tuple[Labels, float]]],
+                         labelnames: Sequence[str] = ()) -> Counter:
+        """Counter read at scrape time from a running total, registering again replaces the callback"""
+        counter = self._get(name, lambda: Counter(name, help, labelnames))
+        counter.collect = collect
+        return counter
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(name, lambda: Gauge(name, help, labelnames))
+
+    def gauge_callback(self, name: str, help: str, collect: Callable[[], Iterable[Tuple[Labels, float]]],
+                       labelnames: Sequence[str] = ()) -> Gauge:
+        """Gauge computed at scrape time, registering again replaces the callback"""
+        gauge = self._get(name, lambda: Gauge(name, help, labelnames))
+        gauge.collect = collect
+        return gauge
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> HistogramFamily:
+        return self._get(name, lambda: HistogramFamily(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            kind = {Counter: 'counter', Gauge: 'gauge', HistogramFamily: 'histogram'}[type(metric)]
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {kind}')
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# error collecting {metric.name}: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task, i.e. how long callbacks block it"""
+
+    def __init__(self, interval: float = 0.5) -> None:
+        self.interval = interval
+        self.lag = registry.histogram(
+            'shuffle_event_loop_lag_seconds', 'Delay between a timer being due and the event loop running it',
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+        )
+        self.current = registry.gauge('shuffle_event_loop_lag_last_seconds', 'Most recent event loop lag sample')
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lag.observe(lag)
+            self.current.set(lag)
+
+
+_server: Any = None
+_monitor: Optional[LoopLagMonitor] = None
+
+async def start_metrics_server(host: str = '127.0.0.1', port: int = 9108) -> None:
+    """Serve `/metrics` over HTTP and start the loop lag monitor, once per process"""
+    global _server, _monitor
+
+    if _monitor is None:
+        _monitor = LoopLagMonitor()
+    _monitor.start()
+
+    if _server is not None:
+        return
+
+    from aiohttp import web
+
+    async def handle(request: Any) -> Any:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _server = runner
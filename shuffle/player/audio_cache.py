@@ -0,0 +1,268 @@
+import json
+import os
+import shutil
+import threading
+import time
+import logging
+
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from shuffle.metrics import registry
+from shuffle.player.cache import LRUCache
+
+INDEX_FILE = 'index.json'
+TMP_DIR = '.tmp'
+
+GB = 1024 ** 3
+
+@dataclass
+class CacheEntry:
+    id: str
+    filename: str
+    size: int
+    created_at: float
+    last_access: float
+    hits: int = 0
+
+
+class AudioCache:
+    """Content-addressed on-disk audio cache keyed by video id.
+
+    Files are fetched into a temp directory and moved into place atomically, the index
+    is persisted next to them so the cache survives restarts, and the least recently
+    used entries are evicted to stay within the byte and count limits. Hits are written
+    to the index `save_delay` seconds after the first unsaved one, so recency survives
+    restarts without a write per play.
+    """
+
+    def __init__(self, path: str, max_bytes: int, max_count: int, min_plays: int = 1, save_delay: float = 30.0,
+                 logger: Optional[logging.Logger] = None) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.min_plays = min_plays
+        self.save_delay = save_delay
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._entries: Dict[str, CacheEntry] = {}
+        self._pending: Set[str] = set()
+        self._plays: LRUCache[int] = LRUCache(maxsize=4096)
+        self._lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.failures = 0
+
+        os.makedirs(self._tmp_path, exist_ok=True)
+        self._load()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.path, INDEX_FILE)
+
+    @property
+    def _tmp_path(self) -> str:
+        return os.path.join(self.path, TMP_DIR)
+
+    @property
+    def size(self) -> int:
+        return sum(e.size for e in self._entries.values())
+
+    def _load(self) -> None:
+        # Leftovers of interrupted fetches
+        for name in os.listdir(self._tmp_path):
+            shutil.rmtree(os.path.join(self._tmp_path, name), ignore_errors=True)
+
+        if not os.path.exists(self._index_path):
+            return
+
+        try:
+            with open(self._index_path, 'r') as f:
+                raw = json.load(f)
+        except Exception as e:
+            self.logger.error(f'Audio cache index not readable, starting empty [{str(e)}]')
+            return
+
+        for data in raw.get('entries', []):
+            entry = CacheEntry(**data)
+            if os.path.exists(os.path.join(self.path, entry.filename)):
+                self._entries[entry.id] = entry
+
+        self.logger.info(f'Loaded audio cache index: {len(self._entries)} tracks, {self.size / GB:.2f} GB')
+
+    def _save(self) -> None:
+        """Write the index atomically, caller holds the lock"""
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+
+        tmp = f'{self._index_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'entries': [asdict(e) for e in self._entries.values()]}, f)
+        os.replace(tmp, self._index_path)
+
+    def get(self, id: str) -> Optional[str]:
+        """Path of the cached file for this id, or None"""
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            path = os.path.join(self.path, entry.filename)
+            if not os.path.exists(path):
+                del self._entries[id]
+                self.misses += 1
+                return None
+
+            entry.last_access = time.time()
+            entry.hits += 1
+            self.hits += 1
+            self._schedule_save()
+            return path
+
+    def _schedule_save(self) -> None:
+        """Save the index once the delay has passed, caller holds the lock"""
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self._save_later)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_later(self) -> None:
+        with self._lock:
+            try:
+                self._save()
+            except Exception as e:
+                self.logger.error(f'Failed to save audio cache index: {str(e)}')
+
+    def contains(self, id: str) -> bool:
+        return id in self._entries
+
+    def record_play(self, id: str) -> bool:
+        """Count a streamed play, returns True once the track is popular enough to cache"""
+        if id in self._entries or id in self._pending:
+            return False
+
+        plays = (self._plays.get(id) or 0) + 1
+        self._plays.set(id, plays)
+        return plays >= self.min_plays
+
+    def add(self, id: str, fetch: Callable[[str], str]) -> Optional[str]:
+        """Fetch a track into the cache.
+
+        `fetch` receives a private temp directory and returns the path of the file it
+        produced there. Blocking, run it off the event loop.
+        """
+        with self._lock:
+            if id in self._entries or id in self._pending:
+                return None
+            self._pending.add(id)
+
+        tmp_dir = os.path.join(self._tmp_path, id)
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            produced = fetch(tmp_dir)
+
+            filename = f'{id}{os.path.splitext(produced)[1]}'
+            size = os.path.getsize(produced)
+            os.replace(produced, os.path.join(self.path, filename))
+
+            now = time.time()
+            with self._lock:
+                self._entries[id] = CacheEntry(id=id, filename=filename, size=size, created_at=now, last_access=now)
+                self._evict()
+                self._save()
+
+            self._plays.pop(id)
+            self.logger.info(f'Cached {id} ({size / 1024 / 1024:.1f} MB)')
+            return os.path.join(self.path, filename)
+        except Exception as e:
+            self.failures += 1
+            self.logger.error(f'Failed to cache {id}: {str(e)}')
+            return None
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            with self._lock:
+                self._pending.discard(id)
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until within limits, caller holds the lock"""
+        total = self.size
+        by_access = sorted(self._entries.values(), key=lambda e: e.last_access)
+
+        while by_access and (total > self.max_bytes or len(self._entries) > self.max_count):
+            entry = by_access.pop(0)
+            del self._entries[entry.id]
+            total -= entry.size
+            self.evictions += 1
+
+            try:
+                os.remove(os.path.join(self.path, entry.filename))
+            except OSError:
+                pass
+
+            self.logger.debug('Evicted %s from audio cache', entry.id)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._save()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'count': len(self._entries),
+                'bytes': self.size,
+                'max_count': self.max_count,
+                'max_bytes': self.max_bytes,
+                'pending': len(self._pending),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'failures': self.failures,
+            }
+
+    def __repr__(self) -> str:
+        return f'AudioCache[path={self.path}, tracks={len(self._entries)}]'
+
+
+_caches: Dict[str, AudioCache] = {}
+_caches_lock = threading.Lock()
+
+def get_audio_cache(config: dict, logger: Optional[logging.Logger] = None) -> AudioCache:
+    """Get the process-wide cache for the configured download path, creating it on first use"""
+    if 'download_path' not in config:
+        raise Exception('No download path configured')
+
+    path = config['download_path']
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = AudioCache(
+                path,
+                max_bytes=int(config.get('track_max_storage', 10) * GB),
+                max_count=config.get('track_max_count', 1000),
+                min_plays=config.get('track_cache_min_plays', 2),
+                save_delay=config.get('track_cache_save_delay', 30.0),
+                logger=logger
+            )
+        return _caches[path]
+
+
+def _collect(key: str) -> Callable[[], List[Tuple[Tuple[str, ...], float]]]:
+    def collect() -> List[Tuple[Tuple[str, ...], float]]:
+        with _caches_lock:
+            caches = list(_caches.values())
+        return [((), sum(cache.stats[key] for cache in caches))]
+    return collect
+
+registry.gauge_callback('shuffle_audio_cache_tracks', 'Tracks stored in the audio cache', _collect('count'))
+registry.gauge_callback('shuffle_audio_cache_bytes', 'Bytes stored in the audio cache', _collect('bytes'))
+registry.gauge_callback('shuffle_audio_cache_max_bytes', 'Audio cache size limit in bytes', _collect('max_bytes'))
+registry.gauge_callback('shuffle_audio_cache_downloads', 'Tracks being fetched into the audio cache', _collect('pending'))
+registry.counter_callback('shuffle_audio_cache_hits_total', 'Plays served from the audio cache', _collect('hits'))
+registry.counter_callback('shuffle_audio_cache_misses_total', 'Plays not in the audio cache', _collect('misses'))
+registry.counter_callback('shuffle_audio_cache_evictions_total', 'Tracks evicted to stay within the limits', _collect('evictions'))
+registry.counter_callback('shuffle_audio_cache_failures_total', 'Tracks that failed to download into the cache', _collect('failures'))
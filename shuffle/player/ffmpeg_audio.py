@@ -4,12 +4,160 @@ import threading
 import asyncio
 import logging
 import shlex
+import time
+
+from shuffle.metrics import registry
+
+# 20ms of 16-bit stereo audio at 48kHz
+FRAME_SIZE = 3840
+BYTES_PER_SECOND = 48000 * 2 * 2
+FRAME_SECONDS = FRAME_SIZE / BYTES_PER_SECOND
+
+# Default ring buffer capacity, in seconds of audio
+BUFFER_SECONDS = 5.0
+
+# Upper bound on a single read from FFmpeg's stdout
+READ_CHUNK = 16384
+
+FFMPEG_SPAWN_SECONDS = registry.histogram(
+    'shuffle_ffmpeg_spawn_seconds', 'Time to start an FFmpeg process',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+FFMPEG_PROCESSES = registry.gauge('shuffle_ffmpeg_processes', 'FFmpeg processes started and not yet cleaned up')
+AUDIO_UNDERRUNS = registry.counter(
+    'shuffle_audio_underruns_total', 'Frames the voice thread had to wait for because the PCM buffer ran dry'
+)
+
+
+def encode_opus_file(source, output, *, bitrate='128k', executable='ffmpeg'):
+    """Encode any audio file to Ogg Opus in the exact shape Discord sends (48kHz stereo, 20ms frames)"""
+    args = [
+        executable, '-nostdin', '-y', '-loglevel', 'error',
+        '-i', source,
+        '-vn',
+        '-c:a', 'libopus',
+        '-b:a', bitrate,
+        '-ar', '48000',
+        '-ac', '2',
+        '-frame_duration', '20',
+        '-application', 'audio',
+        '-f', 'ogg',
+        output
+    ]
+    result = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise Exception(f'FFmpeg opus encode failed: {result.stderr.decode("utf-8", "replace").strip()}')
+
+
+class PCMRingBuffer:
+    """Fixed-capacity byte ring buffer between one writer thread and one reader thread.
+
+    The writer fills free space in place through a memoryview (e.g. with `readinto`)
+    and blocks while the buffer is full, which applies backpressure to the producer.
+    The reader takes whole frames from the front without shifting the rest.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Writer found the buffer full / reader found less than it asked for
+        self.overruns = 0
+        self.underruns = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write_from(self, readinto, limit=READ_CHUNK):
+        """Fill free space with readinto(view), blocking while full. Returns bytes written, 0 at EOF or close"""
+        with self._cond:
+            if self._size == self.capacity and not self._closed:
+                self.overruns += 1
+                self._cond.wait_for(lambda: self._size < self.capacity or self._closed)
+
+            if self._closed:
+                return 0
+
+            end = (self._start + self._size) % self.capacity
+            length = min(self.capacity - self._size, self.capacity - end, limit)
+
+        # Only the writer touches the free region, no need to hold the lock while reading into it
+        written = readinto(self._view[end:end + length]) or 0
+
+        with self._cond:
+            self._size += written
+            self._cond.notify_all()
+
+        return written
+
+    def read(self, size, timeout=None, count_underrun=True):
+        """Take up to `size` bytes, waiting up to `timeout` for that many to be available"""
+        with self._cond:
+            if self._size < size and not self._closed:
+                if count_underrun:
+                    self.underruns += 1
+                self._cond.wait_for(lambda: self._size >= size or self._closed, timeout)
+
+            take = min(size, self._size)
+            if take == 0:
+                return b''
+
+            start = self._start
+            end = start + take
+            if end <= self.capacity:
+                data = bytes(self._view[start:end])
+            else:
+                data = bytes(self._view[start:]) + bytes(self._view[:end - self.capacity])
+
+            self._start = end % self.capacity
+            self._size -= take
+            self._cond.notify_all()
+
+        return data
+
+    def wait_for_size(self, size, timeout=None):
+        """Block until `size` bytes are buffered or no more will arrive"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._size >= min(size, self.capacity) or self._closed, timeout)
+
+    def close(self):
+        """No more data will be written, wakes up both sides"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def clear(self):
+        with self._cond:
+            self._start = 0
+            self._size = 0
+            self._cond.notify_all()
+
+class PipeFFmpegPCMAudio(discord.FFmpegPCMAudio):
+    """discord.py's own reader, frames are read straight off FFmpeg's stdout by the voice thread.
+
+    The fallback when `ffmpeg_reader` is "discord". There is no buffer to fill, so it is
+    ready as soon as FFmpeg is running.
+    """
+
+    def wait_ready(self, timeout=None):
+        return True
+
 
 class BetterFFmpegPCMAudio(discord.AudioSource):
     """A more robust implementation of FFmpegPCMAudio that handles errors better."""
     
     def __init__(self, source, *, executable='ffmpeg', pipe=False, stderr=None, 
-                 before_options=None, options=None, logger=None):
+                 before_options=None, options=None, logger=None, prebuffer=0.0,
+                 buffer_seconds=BUFFER_SECONDS):
         self.source = source
         self.executable = executable
         self.pipe = pipe
@@ -19,15 +167,31 @@ class BetterFFmpegPCMAudio(discord.AudioSource):
         self.logger = logger or logging.getLogger(__name__)
         
         self._process = None
+        self._reaped = False
         self._stderr_thread = None
         self._stdout_thread = None
-        self._buffer = bytearray()
         self._error = None
         self._end = threading.Event()
-        self._has_data = threading.Event()
+
+        # Bounded buffer, always large enough to hold the prebuffer, in whole frames
+        seconds = max(buffer_seconds, prebuffer + 1.0)
+        capacity = int(seconds * BYTES_PER_SECOND) // FRAME_SIZE * FRAME_SIZE
+        self._buffer = PCMRingBuffer(capacity)
+
+        # Ready once `prebuffer` seconds of audio are buffered (or the stream ended)
+        self._prebuffer_bytes = int(prebuffer * BYTES_PER_SECOND)
+        self._started = False
         
         args = self._get_args()
         self._try_start_process(args)
+
+    @property
+    def underruns(self):
+        return self._buffer.underruns
+
+    @property
+    def overruns(self):
+        return self._buffer.overruns
         
     def _get_args(self):
         args = [self.executable]
@@ -37,6 +201,11 @@ class BetterFFmpegPCMAudio(discord.AudioSource):
             
         args.append('-i')
         args.append(self.source)
+        
+        # Output options must come before the output
+        if self.options:
+            args.extend(shlex.split(self.options))
+
         args.append('-f')
         args.append('s16le')
         args.append('-ar')
@@ -44,20 +213,21 @@ class BetterFFmpegPCMAudio(discord.AudioSource):
         args.append('-ac')
         args.append('2')
         args.append('pipe:1')
-        
-        if self.options:
-            args.extend(shlex.split(self.options))
             
         return args
     
     def _try_start_process(self, args):
         try:
-            self.logger.debug(f'Starting FFmpeg process with args: {" ".join(args)}')
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug('Starting FFmpeg process with args: %s', ' '.join(args))
+            started_at = time.perf_counter()
             self._process = subprocess.Popen(
                 args, 
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE if self.stderr else subprocess.DEVNULL
             )
+            FFMPEG_SPAWN_SECONDS.observe(time.perf_counter() - started_at)
+            FFMPEG_PROCESSES.inc()
             
             if self.stderr:
                 self._stderr_thread = threading.Thread(
@@ -76,6 +246,7 @@ class BetterFFmpegPCMAudio(discord.AudioSource):
             self.logger.error(f'Error starting FFmpeg process: {str(e)}')
             self._error = e
             self._end.set()
+            self._buffer.close()
             
     def _stderr_reader(self):
         while self._process and not self._end.is_set():
@@ -85,65 +256,65 @@ class BetterFFmpegPCMAudio(discord.AudioSource):
                 
             try:
                 line = line.decode('utf-8')
-                self.logger.debug(f'FFmpeg stderr: {line.strip()}')
+                self.logger.debug('FFmpeg stderr: %s', line.strip())
             except:
                 pass
                 
     def _stdout_reader(self):
-        chunk_size = 4096  # Adjust as needed
+        stdout = self._process.stdout
         
-        while self._process and not self._end.is_set():
-            try:
-                chunk = self._process.stdout.read(chunk_size)
-                
-                if not chunk:
-                    self._end.set()
+        try:
+            # Blocks while the buffer is full, so FFmpeg is throttled by its stdout pipe
+            while not self._end.is_set():
+                if not self._buffer.write_from(stdout.readinto1):
                     break
                     
-                with threading.Lock():
-                    self._buffer.extend(chunk)
-                    self._has_data.set()
-                    
-            except Exception as e:
+        except Exception as e:
+            if not self._end.is_set():
                 self.logger.error(f'Error reading from FFmpeg stdout: {str(e)}')
                 self._error = e
-                self._end.set()
-                break
+        finally:
+            self._end.set()
+            self._buffer.close()
+
+    def wait_ready(self, timeout=None):
+        """Block until the prebuffer is filled, returns False on timeout or failure"""
+        self._buffer.wait_for_size(self._prebuffer_bytes, timeout=timeout)
+        return self._error is None and len(self._buffer) > 0 and \
+            (len(self._buffer) >= self._prebuffer_bytes or self._buffer.closed)
                 
     def read(self):
         if self._error:
             raise self._error
-            
-        if self._end.is_set() and not self._buffer:
-            return b''
-            
-        # Wait for data (with timeout to prevent hanging)
-        if not self._buffer:
-            self._has_data.wait(timeout=5)
-            
-        # Check again after waiting
-        if not self._buffer:
-            if self._process and self._process.poll() is not None:
-                self._end.set()
+
+        # Read 3840 bytes (20ms of stereo audio at 48kHz), waiting up to 5s for the stream to catch up
+        underruns = self._buffer.underruns
+        data = self._buffer.read(FRAME_SIZE, timeout=5, count_underrun=self._started)
+        if self._buffer.underruns != underruns:
+            AUDIO_UNDERRUNS.inc()
+        if not data:
             return b''
-            
-        # Read 3840 bytes (20ms of stereo audio at 48kHz)
-        with threading.Lock():
-            data = bytes(self._buffer[:3840])
-            del self._buffer[:len(data)]
-            
-            if not self._buffer:
-                self._has_data.clear()
+
+        self._started = True
+
+        # The encoder needs whole frames, pad the tail of the stream with silence
+        if len(data) < FRAME_SIZE:
+            data += b'\x00' * (FRAME_SIZE - len(data))
                 
         return data
         
     def cleanup(self):
         self._end.set()
+        self._buffer.close()
         
         if self._process:
             try:
                 self._process.kill()
             except:
                 pass
+
+            if not self._reaped:
+                self._reaped = True
+                FFMPEG_PROCESSES.dec()
                 
         self._buffer.clear()
@@ -1,9 +1,15 @@
 
 class Guild:
-    def __init__(self, guild_id: int) -> None:
+    def __init__(self, guild_id: int, prefix: str = '!', track_max_duration_min: int = 15,
+                 track_max_count: int = 1000, track_max_storage: int = 10) -> None:
         self.id = guild_id
 
-        self.prefix = '-'
+        self.prefix = prefix
+
+        # Limits from guild_stats, defaults come from the bot config
+        self.track_max_duration_min = track_max_duration_min
+        self.track_max_count = track_max_count
+        self.track_max_storage = track_max_storage
     
     def __repr__(self) -> str:
         return f'Guild[id={self.id}]'
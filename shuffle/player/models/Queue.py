@@ -1,19 +1,27 @@
-
-from typing import List, Optional
-from dataclasses import dataclass
+from collections import deque
+from itertools import islice
+from typing import Deque, Iterator, List, Optional
 
 from shuffle.player.models.Track import Track
 
-@dataclass
+class QueueFullException(Exception):
+    ...
+
 class Queue:
-    def __init__(self) -> None:
-        self.queue: List[Track] = []
+    def __init__(self, max_length: Optional[int] = None) -> None:
+        # Deque for O(1) pops from the front, indexed edits shift the shorter side only
+        self.queue: Deque[Track] = deque()
         self.current: Optional[Track] = None
+        self.max_length = max_length
 
     @property
     def is_empty(self) -> bool:
         return len(self.queue) == 0
 
+    @property
+    def is_full(self) -> bool:
+        return self.max_length is not None and len(self.queue) >= self.max_length
+
     @property
     def is_playing(self) -> bool:
         if self.current is None:
@@ -34,13 +42,42 @@ class Queue:
         return len(self.queue)
 
     def enqueue(self, track: Track) -> None:
+        if self.is_full:
+            raise QueueFullException(f'Queue is full ({self.max_length} tracks)')
         self.queue.append(track)
 
+    def insert(self, index: int, track: Track) -> None:
+        if self.is_full:
+            raise QueueFullException(f'Queue is full ({self.max_length} tracks)')
+        self.queue.insert(index, track)
+
     def pop(self) -> Track:
-        track = self.queue.pop(0)
+        track = self.queue.popleft()
         self.current = track
         return track
 
+    def remove(self, index: int) -> Track:
+        """Remove the track at a 0-based index"""
+        track = self.queue[index]
+        del self.queue[index]
+        return track
+
+    def move(self, index: int, new_index: int) -> Track:
+        """Move the track at a 0-based index to a new position"""
+        track = self.remove(index)
+        self.queue.insert(new_index, track)
+        return track
+
+    def clear(self) -> None:
+        self.queue.clear()
+
+    def page(self, start: int, count: int) -> List[Track]:
+        """Slice of the queue without copying the rest of it"""
+        return list(islice(self.queue, start, start + count))
+
+    def __iter__(self) -> Iterator[Track]:
+        return iter(self.queue)
+
     def __len__(self) -> int:
         return len(self.queue)
 
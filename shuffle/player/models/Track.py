@@ -1,17 +1,27 @@
-
 from typing import Any
 
-from dataclasses import dataclass
-
-@dataclass
 class Track:
-    id: str
-    title: str
-    query: str
-    web_url: str
-    audio_url: str
-    channel: Any = None
-    duration: int = -1
-    source: str = 'youtube'
-    status: str = 'queued'
-    downloaded: bool = False
+    # Slots keep per-track memory small, queues can hold hundreds of these
+    __slots__ = (
+        'id', 'title', 'query', 'web_url', 'audio_url',
+        'channel', 'duration', 'source', 'status', 'downloaded'
+    )
+
+    def __init__(self, id: str, title: str, query: str, web_url: str, audio_url: str,
+                 channel: Any = None, duration: int = -1, source: str = 'youtube',
+                 status: str = 'queued', downloaded: bool = False) -> None:
+        self.id = id
+        self.title = title
+        self.query = query
+        self.web_url = web_url
+        self.audio_url = audio_url
+
+        # Voice channel the track was requested for, a reference to discord's cached object
+        self.channel = channel
+        self.duration = duration
+        self.source = source
+        self.status = status
+        self.downloaded = downloaded
+
+    def __repr__(self) -> str:
+        return f'Track[id={self.id}, title={self.title}, duration={self.duration}, source={self.source}, status={self.status}]'
@@ -2,138 +2,121 @@
 
 import asyncio
 import os
+import time
 import discord
 
-from typing import Any, Optional, Tuple, List
+from typing import Any, AsyncIterator, Callable, Optional, Set, Tuple, List
 
-from shuffle.log import shuffle_logger
+from shuffle.log import guild_logger, shuffle_logger
+from shuffle.admission import BACKGROUND
+from shuffle import tracing
+from shuffle.backoff import Backoff
 
-from shuffle.player.youtube import YoutubeStream
+from shuffle.player.youtube import get_youtube_stream
 from shuffle.player.spotify import SpotifyStream
-
-from shuffle.player.models.Queue import Queue
+from shuffle.player.ffmpeg_audio import BetterFFmpegPCMAudio, PipeFFmpegPCMAudio, FRAME_SECONDS, encode_opus_file
+from shuffle.player.sources import ChainedAudioSource, FirstFrameAudio, OpusFileAudio
+from shuffle.player.audio_cache import AudioCache, get_audio_cache
+from shuffle.player.voice import VoiceManager
+from shuffle.database.snapshots import QueueSnapshot, SnapshotStore, TrackSnapshot, get_snapshot_store
+from shuffle.database.stats import StatsWriter, get_stats_writer
+
+from shuffle.player.models.Queue import Queue, QueueFullException
 from shuffle.player.models.Guild import Guild
 from shuffle.player.models.Track import Track
 
+# Simple FFMPEG options that work reliably
+FFMPEG_OPTIONS = {
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn'
+}
+
 class Player:
     def __init__(self, guild_id: int, config: dict, bot: Any) -> None:
-        self.guild = Guild(guild_id)
-        self.queue = Queue()
+        self.guild = Guild(
+            guild_id,
+            prefix=config.get('prefix', '!'),
+            track_max_duration_min=config.get('track_max_duration_min', 15)
+        )
+        self.queue = Queue(max_length=config.get('queue_max_length', 500))
+        # Stateless drivers, shared by every guild's player
         self.streams = {
-            'youtube': YoutubeStream(guild_id),
+            'youtube': get_youtube_stream(config),
             # 'spotify': SpotifyStream(guild_id)
         }
         self.config = config
         self.bot = bot
 
+        # Shared on-disk cache of popular tracks, keyed by video id
+        self.audio_cache: Optional[AudioCache] = None
+        if config.get('track_cache', True) and 'download_path' in config:
+            self.audio_cache = get_audio_cache(config, logger=shuffle_logger('audio_cache'))
+
+        # Queue checkpoints, restored after a restart
+        self.snapshots: Optional[SnapshotStore] = get_snapshot_store(config, logger=shuffle_logger('snapshots'))
+
+        # Play statistics, buffered and written to the database in batches
+        self.stats: Optional[StatsWriter] = get_stats_writer(config, logger=shuffle_logger('stats'))
+
         self.state = 'idle'  # 'idle', 'playing', 'paused', 'stopped'
 
-        self.client: Optional[List[Any]] = None
+        # Voice connection, kept open for a while after the queue runs out
+        self.voice = VoiceManager(
+            guild_id,
+            bot,
+            idle_timeout=config.get('voice_idle_timeout', 120),
+            connect_timeout=config.get('voice_connect_timeout', 60.0),
+            ready_timeout=config.get('voice_ready_timeout', 5.0),
+            retries=config.get('voice_connect_retries', 3),
+            backoff=Backoff.from_config(config.get('voice_connect_backoff', {})),
+            logger=guild_logger('voice', guild_id)
+        )
+
+        # Tracks that could not be started in a row, spaces out moving on to the next one
+        self._start_failures = 0
+        self._retry_backoff = Backoff.from_config(config.get('track_retry_backoff', {}))
         # Track we were playing when paused - store it to enable resume
         self.paused_track: Optional[Track] = None 
+        # Where to pick the paused track up from when it has to be restarted (after a restore)
+        self._resume_offset = 0.0
 
-        self.log = shuffle_logger(f'player [{self.guild.id}]')
+        # Lookahead - the next track is revalidated and its source opened before the current one ends
+        self._prefetch_task: Optional[asyncio.Task] = None
+        self._prefetched: Optional[Tuple[Track, Any]] = None
+        self._play_started: Optional[float] = None
+        self._paused_at: Optional[float] = None
+
+        # Gapless mode - one chained source stays on the voice client across tracks
+        self._chain: Optional[ChainedAudioSource] = None
+
+        # Playlists still being appended to the queue in the background
+        self._playlist_tasks: Set[asyncio.Task] = set()
+
+        # Last command or playback, idle players are evicted after a while (see ShuffleBot)
+        self.active_at = time.monotonic()
+
+        self.log = guild_logger('player', guild_id)
         self.log.info(f'Created player for {self.guild} with queue {self.queue}')
 
-    async def _play(self, track: Track) -> None:
-        self.log.info(f'Playing {track.title} [{track.web_url}]')
+    async def _play(self, track: Track, offset: float = 0.0) -> None:
+        self.touch()
+        self.log.info(f'Playing {track.title} [{track.web_url}]' + (f' from {offset:.0f}s' if offset else ''))
+
+        # The play request that started this track, tracks played after it start without one
+        span = tracing.detach()
 
         voice = None
 
-        # Check if existing voice client is in the correct channel
-        if self.client is not None:
-            try:
-                # Check if the client is still valid and connected
-                if self.client[0].is_connected():
-                    if track.channel.id != self.client[1]:
-                        self.log.debug(f'Moving from old channel {self.client[1]} to request channel {track.channel.id}')
-                        await self.client[0].move_to(track.channel)
-                        voice = self.client[0]
-                        self.client[1] = track.channel.id
-                    else:
-                        voice = self.client[0]
-                        self.log.debug("Using existing voice client")
-                else:
-                    # Client exists but not connected, clean it up
-                    self.log.debug("Client exists but not connected, cleaning up")
-                    self.client = None
-            except Exception as e:
-                self.log.error(f"Error checking existing client: {e}")
-                # Clean up invalid client
-                try:
-                    if self.client and self.client[0]:
-                        await self.client[0].disconnect(force=True)
-                except:
-                    pass
-                self.client = None
-        
-        # Need a new voice client
-        if voice is None:
-            # First check if bot is already in a voice channel in this guild
-            if self.bot and hasattr(self.bot, 'voice_clients'):
-                for vc in self.bot.voice_clients:
-                    if vc.guild.id == self.guild.id:
-                        self.log.debug("Found existing voice client in guild")
-                        try:
-                            if vc.channel.id != track.channel.id:
-                                await vc.move_to(track.channel)
-                            voice = vc
-                            self.client = [voice, track.channel.id]
-                            break
-                        except Exception as e:
-                            self.log.error(f"Error reusing voice client: {e}")
-                            try:
-                                await vc.disconnect(force=True)
-                            except:
-                                pass
-            
-            # If still no voice client, create new one
-            if voice is None:
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        self.log.debug(f"Attempting to connect to voice channel (attempt {attempt + 1}/{max_retries})")
-                        
-                        # Add timeout and reconnect parameters
-                        voice = await track.channel.connect(timeout=60.0, reconnect=True)
-                        self.client = [voice, track.channel.id]
-                        self.log.debug("Successfully connected to voice channel")
-                        break
-                        
-                    except discord.ClientException as e:
-                        if "Already connected" in str(e):
-                            self.log.warning("Already connected to voice channel, attempting to find it")
-                            # Try to find the existing connection
-                            for vc in self.bot.voice_clients:
-                                if vc.guild.id == self.guild.id:
-                                    voice = vc
-                                    self.client = [voice, vc.channel.id]
-                                    if vc.channel.id != track.channel.id:
-                                        await vc.move_to(track.channel)
-                                        self.client[1] = track.channel.id
-                                    break
-                            if voice:
-                                break
-                        else:
-                            raise
-                            
-                    except IndexError as e:
-                        self.log.error(f"IndexError connecting to voice (attempt {attempt + 1}): {e}")
-                        if attempt < max_retries - 1:
-                            await asyncio.sleep(2)  # Wait longer between retries
-                        else:
-                            self.log.error("Failed to connect after all retries - Discord voice servers may be having issues")
-                            
-                    except Exception as e:
-                        self.log.error(f"Unexpected error connecting to voice: {type(e).__name__}: {e}")
-                        import traceback
-                        self.log.error(traceback.format_exc())
-                        
-                        if attempt < max_retries - 1:
-                            await asyncio.sleep(1)
+        # Reuses the lingering connection (moving channels if needed), only handshakes when there is none
+        try:
+            voice = await self.voice.connect(track.channel)
+        except Exception as e:
+            self.log.error(f'Error connecting to voice: {type(e).__name__}: {e}')
 
         if voice is None:
             self.log.error("Failed to establish voice connection")
+            if span is not None:
+                span.finish('voice_failed')
             # Clean up
             self.queue.current = None
             self.paused_track = None
@@ -142,47 +125,102 @@ class Player:
             # Try next in queue if available
             if not self.queue.is_empty:
                 self.log.info("Trying next track in queue...")
-                await asyncio.sleep(3)  # Give Discord more time
+                await self._retry_delay()
                 asyncio.create_task(self._play(self.queue.pop()))
+            self._checkpoint()
             return
 
-        # Ensure voice client is ready
-        await asyncio.sleep(0.5)  # Small delay to ensure connection is stable
-        
-        # Simple FFMPEG options that work reliably
-        FFMPEG_OPTIONS = {
-            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-            'options': '-vn'
-        }
+        # Connected and ready, the manager waits for that rather than a fixed delay
+        if span is not None:
+            span.mark('voice_connected')
+
+        # Use the prefetched source if the lookahead already opened this track
+        audio_source: Any = self._take_prefetched(track) if not offset else None
+        if audio_source is not None:
+            self.log.debug('Using prefetched audio source')
+        elif not self._check_for_file(track.id) and not await self.streams[track.source].refresh_track(self.guild.id, track):
+            self.log.warning(f'Could not refresh audio URL for {track.title}, trying the old one')
+
+        if span is not None:
+            span.mark('url_ready')
         
-        self.log.debug(f'Attempting to play with audio URL: {track.audio_url[:100]}...')
+        self.log.debug('Attempting to play with audio URL: %s...', track.audio_url[:100])
         
         # Track if we successfully started playing
         started_playing = False
+
+        # Resolved by the voice client's after callback once playback ends (finished, stopped or disconnected)
+        loop = asyncio.get_event_loop()
+        done: asyncio.Future = loop.create_future()
+
+        def after_playing(error):
+            if error:
+                self.log.error(f'Playback error: {error}')
+            else:
+                self.log.debug('Playback ended normally')
+            loop.call_soon_threadsafe(self._playback_finished, done, error)
+
+        def traced(source: Any) -> Any:
+            # Time to first audio ends when the voice thread reads the first frame
+            if span is None:
+                return source
+            request = span
+
+            def first_frame() -> None:
+                request.mark('first_audio')
+                loop.call_soon_threadsafe(request.finish, 'ok')
+
+            return FirstFrameAudio(source, first_frame)
         
         try:
-            self.log.debug("Creating FFmpegPCMAudio instance...")
-            
-            # Create the audio source
-            audio_source = discord.FFmpegPCMAudio(
-                track.audio_url, 
-                **FFMPEG_OPTIONS
-            )
-            
-            self.log.debug("Created FFmpegPCMAudio instance successfully")
-            
-            # Create an error callback
-            def after_playing(error):
-                if error:
-                    self.log.error(f'Playback error: {error}')
-                else:
-                    self.log.debug('Playback ended normally')
+            if audio_source is None:
+                self.log.debug("Creating audio source...")
+                
+                if not track.audio_url and not self._check_for_file(track.id):
+                    raise Exception(f'No audio URL for {track.title}')
+
+                # Create the audio source, ready once its first frame is buffered
+                audio_source = self._create_source(track, prebuffer=FRAME_SECONDS, offset=offset)
+                
+                self.log.debug("Created audio source successfully")
+
+                if span is not None:
+                    span.mark('source_created')
+
+                # A dead stream fails here, instead of playing a few seconds of silence and ending
+                timeout = self.config.get('first_audio_timeout', 10.0)
+                if not await loop.run_in_executor(None, audio_source.wait_ready, timeout):
+                    audio_source.cleanup()
+                    raise Exception(f'No audio from source within {timeout:.0f}s')
+
+            if span is not None:
+                span.mark('source_ready')
+            audio_source = traced(audio_source)
+
+            # Gapless mode hands the lookahead's source to the chain instead of restarting playback
+            if self.config.get('gapless', False):
+                self._chain = ChainedAudioSource(
+                    audio_source,
+                    on_advance=lambda next_track: loop.call_soon_threadsafe(self._on_chain_advance, next_track),
+                    logger=self.log
+                )
+                audio_source = self._chain
             
             # Start playing
             voice.play(audio_source, after=after_playing)
             self.state = 'playing'
             started_playing = True
             self.log.debug("Playback started successfully")
+            self._start_failures = 0
+            if span is not None:
+                span.mark('playing')
+
+            self._play_started = asyncio.get_event_loop().time() - offset
+            self._paused_at = None
+            self._schedule_prefetch(track)
+            self._maybe_cache(track)
+            self._record_play(track)
+            self._checkpoint()
             
         except Exception as e:
             self.log.error(f'Error creating audio source: {str(e)}')
@@ -190,11 +228,11 @@ class Player:
             self.log.error(traceback.format_exc())
             
             # Try a simpler approach
-            if not started_playing:
+            if not started_playing and track.audio_url:
                 try:
                     self.log.info('Attempting minimal FFmpeg options')
-                    audio_source = discord.FFmpegPCMAudio(track.audio_url)
-                    voice.play(audio_source)
+                    audio_source = traced(discord.FFmpegPCMAudio(track.audio_url))
+                    voice.play(audio_source, after=after_playing)
                     self.state = 'playing'
                     started_playing = True
                     self.log.debug("Minimal playback started")
@@ -203,57 +241,55 @@ class Player:
 
         # If we couldn't start playing at all, skip to next track
         if not started_playing:
+            if span is not None:
+                span.finish('error')
             self.queue.current = None
             self.paused_track = None
             
             # Don't disconnect - might be useful for next track
             if not self.queue.is_empty and self.state != 'stopped':
                 self.log.debug('Skipping to next track...')
-                await asyncio.sleep(1)
+                await self._retry_delay()
                 asyncio.create_task(self._play(self.queue.pop()))
                 return
             else:
-                self.log.debug('No more tracks, disconnecting')
+                self.log.debug('No more tracks, leaving voice once idle')
                 self.state = 'idle'
-                if voice:
-                    try:
-                        await voice.disconnect()
-                    except:
-                        pass
-                self.client = None
+                self._checkpoint()
+                self.voice.release()
                 return
 
-        # Wait for the song to finish playing
-        while voice.is_connected() and (voice.is_playing() or voice.is_paused()):
-            await asyncio.sleep(0.5)
+        # Wait for the song (or in gapless mode, the chain of songs) to finish playing
+        await done
+        self.touch()
+
+        self._chain = None
+        track = self.queue.current or track
             
-        self.log.debug(f'Done playing {track.title}')
+        self.log.debug('Done playing %s', track.title)
 
         # Check why we stopped
         if not voice.is_connected():
             self.log.debug('Voice disconnected during playback')
             self.state = 'idle'
-            self.client = None
             return
             
         if self.state == 'stopped' or self.state == 'paused':
-            self.log.debug(f'Playback {self.state}, not continuing queue')
+            self.log.debug('Playback %s, not continuing queue', self.state)
             return
 
         # Continue with queue if available
         if not self.queue.is_empty and self.state == 'playing':
-            self.log.debug(f'Playing next song from queue ({len(self.queue.queue)} remaining)...')
-            await self._play(self.queue.pop())
+            self.log.debug('Playing next song from queue (%s remaining)...', len(self.queue.queue))
+            loop.create_task(self._play(self.queue.pop()))
         else:
-            self.log.info('Queue empty, disconnecting')
+            self.log.info('Queue empty, leaving voice once idle')
             self.queue.current = None
             self.paused_track = None
             self.state = 'idle'
-            try:
-                await voice.disconnect()
-            except:
-                pass
-            self.client = None
+            self._reset_lookahead()
+            self._checkpoint()
+            self.voice.release()
     
     async def enqueue(self, query: str, channel: Any) -> Track:
         selected_stream_driver = 'youtube'
@@ -263,14 +299,30 @@ class Player:
             self.log.error(f'Stream \'{selected_stream_driver}\' is not ready')
             return None
 
-        track = await asyncio.get_event_loop().run_in_executor(None, lambda: stream.get_track(query))
+        if stream.is_playlist(query):
+            return await self._enqueue_playlist(stream.stream_playlist(
+                self.guild.id, query,
+                limit=self.config.get('playlist_max_tracks', 200),
+                batch_size=self.config.get('playlist_batch_size', 25)
+            ), channel)
+
+        track = await stream.fetch_track(self.guild.id, query)
         if track is None:
             self.log.error(f'Failed to get track for query: {query}')
             raise Exception('Failed to get track URL')
             
+        self._add_track(track, channel)
+        return track
+
+    def is_playlist(self, query: str) -> bool:
+        return self.streams['youtube'].is_playlist(query)
+
+    def _add_track(self, track: Track, channel: Any) -> None:
         track.channel = channel
         self.queue.enqueue(track)
-        self.log.debug(f'Enqueued {track}')
+        self.log.debug('Enqueued %s', track)
+        tracing.mark('enqueued')
+        self._checkpoint()
 
         if self.state == 'idle':
             self.state = 'playing'
@@ -278,21 +330,54 @@ class Player:
         else:
             self.log.info(f'Queued track @{self.queue.length}: {track.title} [{track.web_url}]')
 
-        return track
+    async def _enqueue_playlist(self, batches: AsyncIterator[List[Track]], channel: Any) -> Track:
+        """Queue the first playlist entry right away, stream the rest into the queue in the background"""
+        try:
+            first_batch = await batches.__anext__()
+        except StopAsyncIteration:
+            raise Exception('Playlist is empty or could not be loaded')
+
+        for track in first_batch:
+            self._add_track(track, channel)
+
+        task = asyncio.get_event_loop().create_task(self._load_playlist(batches, channel))
+        self._playlist_tasks.add(task)
+        task.add_done_callback(self._playlist_tasks.discard)
+
+        return first_batch[0]
+
+    async def _load_playlist(self, batches: AsyncIterator[List[Track]], channel: Any) -> None:
+        # The play request is traced to its first track, not the rest of the playlist
+        tracing.detach()
+
+        count = 0
+        try:
+            async for batch in batches:
+                for track in batch:
+                    self._add_track(track, channel)
+                    count += 1
+        except QueueFullException:
+            self.log.info('Queue is full, not loading the rest of the playlist')
+        finally:
+            self.log.info(f'Loaded {count} more playlist tracks')
 
     async def stop(self) -> None:
         """
         Stop playback but remember current track for possible resume.
         This doesn't clear the queue.
         """
-        if self.client is None:
+        voice = self.voice.client
+        if voice is None:
             return
 
-        if self.client[0].is_connected() and self.client[0].is_playing():
+        if voice.is_playing():
             # Remember the current track so we can resume it later
             self.paused_track = self.queue.current
-            self.client[0].pause()  # Use pause instead of stop to keep the voice client connected
+            voice.pause()  # Use pause instead of stop to keep the voice client connected
             self.state = 'paused'
+            self._paused_at = asyncio.get_event_loop().time()
+            self._cancel_prefetch()
+            self._checkpoint()
             self.log.info(f'Paused playback of {self.paused_track.title if self.paused_track else "unknown"}')
             # Don't disconnect - keep the connection for resume functionality
         else:
@@ -303,7 +388,7 @@ class Player:
         Resume playback if it was stopped.
         Returns True if successfully resumed, False otherwise.
         """
-        self.log.debug(f"Resume called. State: {self.state}, Paused track: {self.paused_track}, Client: {self.client}")
+        self.log.debug("Resume called. State: %s, Paused track: %s, Voice: %s", self.state, self.paused_track, self.voice)
         
         # If we're already playing, do nothing
         if self.state == 'playing':
@@ -311,10 +396,17 @@ class Player:
             return False
             
         # If we have a paused track and the client is still connected
-        if self.paused_track and self.client is not None and self.client[0].is_connected():
+        if self.paused_track and self.voice.client is not None:
             self.log.info(f"Resuming playback of {self.paused_track.title}")
-            self.client[0].resume()  # Resume the paused playback
+            self.voice.client.resume()  # Resume the paused playback
             self.state = 'playing'
+
+            # Shift the start time by the time spent paused so the lookahead stays on schedule
+            if self._play_started is not None and self._paused_at is not None:
+                self._play_started += asyncio.get_event_loop().time() - self._paused_at
+            self._paused_at = None
+            self._schedule_prefetch(self.paused_track)
+            self._checkpoint()
             return True
             
         # If we have a paused track but need to reconnect
@@ -326,9 +418,11 @@ class Player:
             if target_channel:
                 self.queue.current = self.paused_track
                 track = self.paused_track
+                track.channel = target_channel
                 self.paused_track = None
-                
-                asyncio.get_event_loop().create_task(self._play(track))
+
+                offset, self._resume_offset = self._resume_offset, 0.0
+                asyncio.get_event_loop().create_task(self._play(track, offset=offset))
                 return True
             else:
                 self.log.error("Cannot resume: No voice channel specified")
@@ -351,59 +445,369 @@ class Player:
 
 
     async def clear(self) -> None:
+        for task in list(self._playlist_tasks):
+            task.cancel()
+
         if not self.queue.is_empty:
-            self.queue.queue = []
+            self.queue.clear()
+
+        self._reset_lookahead()
+        self._checkpoint()
 
     
     async def skip(self) -> int:
-        if self.client is None:
+        voice = self.voice.client
+        if voice is None:
             return 0
 
         # If we're paused, clear the paused track 
         if self.state == 'paused':
             self.paused_track = None
-            
-        if self.client[0].is_connected():
-            # Stop current playback regardless of if it's playing or paused
-            if self.client[0].is_playing():
-                self.client[0].stop()
-            
-            if not self.queue.is_empty:
-                self.log.info(f'Queue is nonempty, skipping to the next song...')
-                self.state = 'playing'
-                asyncio.get_event_loop().create_task(self._play(self.queue.pop()))
-                
-                return len(self.queue)
-            else:
-                self.log.info(f'Queue is empty')
-                self.queue.current = None
-                self.paused_track = None
-                self.state = 'idle'
-                await self.client[0].disconnect()
-                self.client = None
 
-                return -1
+        # Gapless mode switches the chain straight to the prefetched next track
+        if self._chain is not None and voice.is_playing() and not self.queue.is_empty \
+                and self._chain.next_key is self.queue.peek and self._chain.skip():
+            self.log.info('Skipping to the prefetched next song...')
+            return len(self.queue) - 1
+
+        if not self.queue.is_empty:
+            self.log.info('Queue is nonempty, skipping to the next song...')
+            self.state = 'playing'
+
+            # Stopping fires the playback-finished event, which advances the queue
+            if voice.is_playing() or voice.is_paused():
+                voice.stop()
+                return len(self.queue) - 1
+
+            # Nothing to stop, the next track is popped right here
+            asyncio.get_event_loop().create_task(self._play(self.queue.pop()))
+            return len(self.queue)
+
+        # Stop current playback regardless of if it's playing or paused
+        if voice.is_playing() or voice.is_paused():
+            voice.stop()
+
+        self.log.info('Queue is empty')
+        self.queue.current = None
+        self.paused_track = None
+        self.state = 'idle'
+        self._checkpoint()
+        self.voice.release()
 
         return -1
 
     
-    def list(self) -> List[Track]:
-        return self.queue.queue
+    def list(self, start: int = 0, count: Optional[int] = None) -> List[Track]:
+        return self.queue.page(start, len(self.queue) if count is None else count)
+
+
+    async def remove(self, index: int) -> Track:
+        """Remove the track at a 0-based queue position"""
+        track = self.queue.remove(index)
+        if index == 0:
+            self._queue_head_changed()
+        self._checkpoint()
+        return track
+
+
+    async def move(self, index: int, new_index: int) -> Track:
+        """Move the track at a 0-based queue position to another"""
+        track = self.queue.move(index, new_index)
+        if index == 0 or new_index == 0:
+            self._queue_head_changed()
+        self._checkpoint()
+        return track
 
     
-    def _get_track_file(self, id: str) -> str:
-        if 'download_path' not in self.config:
-            raise Exception('No download path configured')
+    def _create_source(self, track: Track, prebuffer: float = 0.0, offset: float = 0.0) -> Any:
+        seek = f'-ss {offset:.2f}' if offset else ''
+
+        path = self._get_track_file(track.id) if self._check_for_file(track.id) else None
+        if path is not None:
+            self.log.debug('Playing %s from local cache', track.title)
+
+            # Pre-encoded Opus is sent as-is, no FFmpeg and no encoder (only FFmpeg can seek)
+            if path.endswith('.opus') and not offset:
+                return OpusFileAudio(path)
+
+            return self._ffmpeg_source(path, prebuffer, before_options=seek, options='-vn')
+
+        return self._ffmpeg_source(
+            track.audio_url,
+            prebuffer,
+            before_options=f'{FFMPEG_OPTIONS["before_options"]} {seek}'.strip(),
+            options=FFMPEG_OPTIONS['options']
+        )
+
+    def _ffmpeg_source(self, source: str, prebuffer: float, before_options: str, options: str) -> Any:
+        # discord.py's reader stays available as a fallback for the buffered one
+        if self.config.get('ffmpeg_reader', 'buffered') == 'discord':
+            return PipeFFmpegPCMAudio(source, before_options=before_options, options=options)
+
+        return BetterFFmpegPCMAudio(source, logger=self.log, prebuffer=prebuffer, before_options=before_options, options=options)
+
+    def _elapsed(self) -> float:
+        """Seconds of the current track played so far, excluding time paused"""
+        if self._play_started is None:
+            return 0.0
+
+        now = self._paused_at if self._paused_at is not None else asyncio.get_event_loop().time()
+        return now - self._play_started
+
+    def _schedule_prefetch(self, track: Track) -> None:
+        self._cancel_prefetch()
+
+        # Unknown length (e.g. live streams), nothing to schedule against
+        if track.duration is None or track.duration <= 0:
+            return
+
+        lead = self.config.get('prefetch_lead', 10)
+        delay = max(0.0, track.duration - lead - self._elapsed())
+        self._prefetch_task = asyncio.get_event_loop().create_task(self._prefetch(delay))
+
+    def _cancel_prefetch(self) -> None:
+        if self._prefetch_task is not None and not self._prefetch_task.done():
+            self._prefetch_task.cancel()
+        self._prefetch_task = None
+
+    async def _prefetch(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+
+        if self.queue.is_empty:
+            return
+
+        track = self.queue.peek
+        if self._chain is not None and self._chain.next_key is track:
+            return
+        if self._prefetched is not None:
+            if self._prefetched[0] is track:
+                return
+            self._discard_prefetched()
+
+        self.log.debug('Prefetching next track %s', track.title)
+
+        # Queued URLs can go stale while waiting, revalidate before opening
+        if not self._check_for_file(track.id) and not await self.streams[track.source].refresh_track(self.guild.id, track, BACKGROUND):
+            return
+
+        source = self._create_source(track, prebuffer=self.config.get('prefetch_buffer', 3.0))
+        try:
+            ready = await asyncio.get_event_loop().run_in_executor(
+                None, source.wait_ready, self.config.get('prefetch_timeout', 10.0)
+            )
+        except asyncio.CancelledError:
+            source.cleanup()
+            raise
+
+        # The queue may have changed while we were buffering
+        if not ready or self.queue.is_empty or self.queue.peek is not track:
+            self.log.debug('Dropping prefetched source for %s (ready=%s)', track.title, ready)
+            source.cleanup()
+            return
+
+        if self._chain is not None and self._chain.accepts(source):
+            self._chain.queue_next(source, track)
+        else:
+            self._prefetched = (track, source)
+        self.log.debug('Prefetched %s', track.title)
+
+    async def _retry_delay(self) -> None:
+        """Back off before the next track after one failed to start, longer the more fail in a row"""
+        delay = self._retry_backoff.delay(self._start_failures)
+        self._start_failures += 1
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _playback_finished(self, done: asyncio.Future, error: Optional[Exception]) -> None:
+        if not done.done():
+            done.set_result(error)
+
+    def _on_chain_advance(self, track: Track) -> None:
+        """Runs on the loop once the chained source has switched to the next track"""
+        if not self.queue.is_empty and self.queue.peek is track:
+            self.queue.pop()
+        else:
+            self.queue.current = track
+
+        self.log.info(f'Playing {track.title} [{track.web_url}] (gapless)')
+
+        self._play_started = asyncio.get_event_loop().time()
+        self._paused_at = None
+        self._schedule_prefetch(track)
+        self._maybe_cache(track)
+        self._record_play(track)
+        self._checkpoint()
+
+    def _queue_head_changed(self) -> None:
+        """The lookahead prefetched the wrong track, start over for the new head"""
+        self._reset_lookahead()
+        if self.state == 'playing' and self.queue.current is not None:
+            self._schedule_prefetch(self.queue.current)
+
+    def _reset_lookahead(self) -> None:
+        """Drop everything prefetched, e.g. after the queue changed"""
+        self._cancel_prefetch()
+        self._discard_prefetched()
+        if self._chain is not None:
+            self._chain.clear_next()
+
+    def _take_prefetched(self, track: Track) -> Any:
+        self._cancel_prefetch()
+
+        if self._prefetched is None:
+            return None
+
+        prefetched_track, source = self._prefetched
+        self._prefetched = None
+
+        if prefetched_track is track:
+            return source
 
-        if not os.path.exists(f'{self.config["download_path"]}'):
-            os.mkdir(f'{self.config["download_path"]}')
+        source.cleanup()
+        return None
 
-        return f'{self.config["download_path"]}/{id}.mp3'
+    def _discard_prefetched(self) -> None:
+        if self._prefetched is not None:
+            self._prefetched[1].cleanup()
+            self._prefetched = None
+
+    def _get_track_file(self, id: str) -> Optional[str]:
+        if self.audio_cache is None:
+            raise Exception('No download path configured')
+
+        return self.audio_cache.get(id)
 
 
     def _check_for_file(self, id: str) -> bool:
-        return os.path.exists(self._get_track_file(id))
+        return self.audio_cache is not None and self.audio_cache.contains(id)
+
+
+    def _maybe_cache(self, track: Track) -> None:
+        """Download a streamed track into the local cache in the background once it's popular"""
+        if self.audio_cache is None:
+            return
+
+        max_duration = self.guild.track_max_duration_min * 60
+        if track.duration is None or track.duration <= 0 or track.duration > max_duration:
+            return
+
+        if not self.audio_cache.record_play(track.id):
+            return
+
+        stream = self.streams[track.source]
+
+        def fetch(tmp_dir: str) -> str:
+            stream.download(track.id, os.path.join(tmp_dir, f'{track.id}.%(ext)s'))
+            files = os.listdir(tmp_dir)
+            if len(files) != 1:
+                raise Exception(f'Expected one downloaded file, found {files}')
+
+            # Encode once to Opus so every later play skips decode and encode
+            downloaded = os.path.join(tmp_dir, files[0])
+            encoded = os.path.join(tmp_dir, f'{track.id}.opus.tmp')
+            encode_opus_file(downloaded, encoded, bitrate=self.config.get('track_cache_bitrate', '128k'))
+            os.remove(downloaded)
+
+            output = os.path.join(tmp_dir, f'{track.id}.opus')
+            os.replace(encoded, output)
+            return output
+
+        self.log.debug('Caching %s [%s]', track.title, track.id)
+        asyncio.get_event_loop().run_in_executor(None, self.audio_cache.add, track.id, fetch)
         
+    def _record_play(self, track: Track) -> None:
+        if self.stats is not None:
+            self.stats.record_play(self.guild.id, track)
+
+    def _checkpoint(self) -> None:
+        if self.snapshots is not None:
+            self.snapshots.mark_dirty(self.guild.id, self.snapshot)
+
+    def freeze(self) -> None:
+        """Checkpoint one last time before going down, what disconnecting does to the state is not saved"""
+        self._checkpoint()
+        self.snapshots = None
+
+    def snapshot(self) -> QueueSnapshot:
+        """Current queue and playback state, for checkpointing"""
+        def record(track: Track) -> TrackSnapshot:
+            return TrackSnapshot(
+                id=track.id, title=track.title, query=track.query, web_url=track.web_url,
+                duration=track.duration, source=track.source,
+                channel_id=track.channel.id if track.channel is not None else None
+            )
+
+        current = self.paused_track or self.queue.current
+        if self.state not in ('playing', 'paused', 'stopped'):
+            current = None
+
+        return QueueSnapshot(
+            guild_id=self.guild.id,
+            status='playing' if self.state == 'playing' and current is not None else 'waiting',
+            event={'playing': 'play', 'paused': 'pause', 'stopped': 'stop'}.get(self.state, 'none'),
+            position=(self._elapsed() or self._resume_offset) if current is not None else 0.0,
+            current=record(current) if current is not None else None,
+            tracks=[record(t) for t in self.queue]
+        )
+
+    async def restore(self, resolve_channel: Callable[[int], Any]) -> None:
+        """Load the last checkpoint of this guild's queue, resuming playback if it was playing"""
+        if self.snapshots is None:
+            return
+
+        try:
+            snapshot = await self.snapshots.load(self.guild.id)
+        except Exception as e:
+            self.log.error(f'Failed to load queue snapshot: {str(e)}')
+            return
+
+        if snapshot is None or snapshot.is_empty:
+            return
+
+        def track(record: TrackSnapshot) -> Track:
+            # Audio URLs expire, they are resolved again when the track comes up
+            return Track(
+                id=record.id, title=record.title, query=record.query, web_url=record.web_url,
+                audio_url='', duration=record.duration, source=record.source,
+                channel=resolve_channel(record.channel_id) if record.channel_id is not None else None
+            )
+
+        for record in snapshot.tracks:
+            try:
+                self.queue.enqueue(track(record))
+            except QueueFullException:
+                break
+
+        current = track(snapshot.current) if snapshot.current is not None else None
+        if current is not None and current.channel is not None and snapshot.status == 'playing':
+            self.log.info(f'Restored queue, resuming {current.title} at {snapshot.position:.0f}s')
+            self.queue.current = current
+            self.state = 'playing'
+            asyncio.get_event_loop().create_task(self._play(current, offset=snapshot.position))
+        elif current is not None:
+            # Paused (or nowhere to play), resuming picks it up again
+            self.log.info(f'Restored queue with {current.title} paused at {snapshot.position:.0f}s')
+            self.queue.current = current
+            self.paused_track = current
+            self._resume_offset = snapshot.position
+            self.state = 'paused'
+        else:
+            self.log.info(f'Restored queue with {len(self.queue)} tracks')
+
+    def touch(self) -> None:
+        self.active_at = time.monotonic()
+
+    def evictable(self, ttl: float, now: float) -> bool:
+        """Nothing playing or loading, and no command or playback for `ttl` seconds"""
+        if self.state == 'playing' or self._playlist_tasks:
+            return False
+        return now - self.active_at >= ttl
+
+    async def close(self) -> None:
+        """Let go of prefetched sources and the voice connection, checkpoint first to keep the queue"""
+        self._reset_lookahead()
+        await self.voice.disconnect()
+
     def get_state(self) -> str:
         """Returns the current player state as a string."""
         if self.state == 'paused' and self.paused_track:
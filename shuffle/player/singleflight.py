@@ -0,0 +1,51 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar('T')
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls for the same key into one in-flight task.
+
+    The first caller for a key starts the work, callers arriving while it is pending
+    await the same task and all receive its result (or exception). A caller being
+    cancelled does not cancel the shared work for the others.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, 'asyncio.Future[T]'] = {}
+
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self.started += 1
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: 'asyncio.Future[T]') -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+        # Mark the exception retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'inflight': len(self._inflight),
+            'started': self.started,
+            'coalesced': self.coalesced,
+        }
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -9,7 +9,8 @@ from shuffle.log import shuffle_logger
 
 class SpotifyStream(Stream):
     def __init__(self, guild_id: int) -> None:
-        super().__init__(guild_id)
+        # Only set up for whitelisted guilds, so unlike the other streams this one is per guild
+        self.guild_id = guild_id
 
         self.logger = shuffle_logger('spotify')
 
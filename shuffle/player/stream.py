@@ -1,11 +1,14 @@
 
+import asyncio
+
 from abc import ABC
+from typing import AsyncIterator, List
 
+from shuffle.admission import INTERACTIVE
 from shuffle.player.models.Track import Track
 
 class Stream(ABC):
-    def __init__(self, guild_id: int) -> None:
-        self.guild_id = guild_id
+    """A source of tracks, one per process and shared by every guild. Calls made for a guild pass its id"""
 
     def download(self, video_hash: str, path: str) -> None:
         ...
@@ -13,5 +16,21 @@ class Stream(ABC):
     def get_track(self, query: str) -> Track:
         ...
 
+    async def fetch_track(self, guild_id: int, query: str, priority: int = INTERACTIVE) -> Track:
+        return await asyncio.get_event_loop().run_in_executor(None, lambda: self.get_track(query))
+
+    def is_playlist(self, query: str) -> bool:
+        return False
+
+    async def stream_playlist(self, guild_id: int, query: str, limit: int = 200, batch_size: int = 25) -> AsyncIterator[List[Track]]:
+        """Expand a playlist into batches of (possibly unresolved) tracks. Streams without
+        playlists (is_playlist() is always False) have nothing to expand"""
+        return
+        yield  # Never reached, makes this an async generator like the overrides
+
+    async def refresh_track(self, guild_id: int, track: Track, priority: int = INTERACTIVE) -> bool:
+        """Make sure the track's audio URL is still playable, returns False if it can't be"""
+        return True
+
     def is_ready(self) -> bool:
         ...
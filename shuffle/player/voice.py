@@ -0,0 +1,200 @@
+import asyncio
+import time
+import logging
+
+from typing import Any, Optional, Tuple, Union
+
+import discord
+
+from shuffle.backoff import Backoff
+from shuffle.metrics import registry
+
+VOICE_CONNECT_SECONDS = registry.histogram(
+    'shuffle_voice_connect_seconds', 'Time to get a usable voice connection for a track, by how it was obtained',
+    ('result',)
+)
+VOICE_IDLE_DISCONNECTS = registry.counter(
+    'shuffle_voice_idle_disconnects_total', 'Voice connections closed after sitting idle for the grace period'
+)
+
+class VoiceConnectError(Exception):
+    ...
+
+class VoiceManager:
+    """A guild's voice connection, kept open for a grace period after playback stops.
+
+    `connect` reuses the open connection (moving it if the request is for another
+    channel in the guild), adopts one discord.py already holds for the guild, and only
+    then does the voice handshake. `release` starts the idle timer instead of
+    disconnecting, so a track requested within `idle_timeout` seconds starts without
+    reconnecting.
+    """
+
+    def __init__(self, guild_id: int, bot: Any, idle_timeout: float = 120.0, connect_timeout: float = 60.0,
+                 ready_timeout: float = 5.0, retries: int = 3, backoff: Backoff = Backoff(),
+                 logger: Optional[Union[logging.Logger, logging.LoggerAdapter]] = None) -> None:
+        self.guild_id = guild_id
+        self.bot = bot
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.ready_timeout = ready_timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._client: Any = None
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def client(self) -> Any:
+        """The connected voice client, None if there is none"""
+        if self._client is not None and self._client.is_connected():
+            return self._client
+        return None
+
+    @property
+    def channel_id(self) -> Optional[int]:
+        client = self.client
+        return client.channel.id if client is not None else None
+
+    @property
+    def idle(self) -> bool:
+        return self._idle_handle is not None
+
+    async def connect(self, channel: Any) -> Any:
+        """Get a connected voice client in `channel`, raises VoiceConnectError if there is no way to"""
+        self._cancel_idle()
+
+        # Requests racing for the same guild share the first one's connection
+        async with self._lock:
+            started_at = time.perf_counter()
+            try:
+                voice, result = await self._connect(channel)
+            except Exception:
+                VOICE_CONNECT_SECONDS.observe(time.perf_counter() - started_at, 'failed')
+                raise
+
+            if not await self._wait_ready(voice):
+                VOICE_CONNECT_SECONDS.observe(time.perf_counter() - started_at, 'failed')
+                raise VoiceConnectError(f'Voice connection not ready after {self.ready_timeout:.0f}s')
+
+            VOICE_CONNECT_SECONDS.observe(time.perf_counter() - started_at, result)
+            return voice
+
+    async def _wait_ready(self, voice: Any) -> bool:
+        """Wait for the voice websocket to be connected, e.g. while discord.py reconnects it after a move"""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.ready_timeout
+        interval = 0.01
+
+        # discord.py only exposes this as a thread event, poll it with a short, growing interval
+        while not voice.is_connected():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, 0.25)
+
+        return True
+
+    async def _connect(self, channel: Any) -> Tuple[Any, str]:
+        voice, result = self.client, 'reused'
+        if voice is None:
+            # Connected outside the manager, e.g. by a player from before a restart
+            voice, result = self._find_existing(), 'adopted'
+
+        if voice is not None:
+            if voice.channel.id != channel.id:
+                self.logger.debug('Moving from channel %s to %s', voice.channel.id, channel.id)
+                await voice.move_to(channel)
+                result = 'moved'
+
+            self._client = voice
+            return voice, result
+
+        if self._client is not None:
+            # Dropped by Discord (kicked, server moved), clear it out before reconnecting
+            await self._force_disconnect(self._client)
+            self._client = None
+
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries):
+            try:
+                self.logger.debug('Connecting to voice channel %s (attempt %s/%s)', channel.id, attempt + 1, self.retries)
+                self._client = await channel.connect(timeout=self.connect_timeout, reconnect=True)
+                return self._client, 'connected'
+            except discord.ClientException as e:
+                # Connected in the meantime by someone else, use that connection
+                existing = self._find_existing()
+                if existing is None:
+                    raise VoiceConnectError(str(e))
+                if existing.channel.id != channel.id:
+                    await existing.move_to(channel)
+                self._client = existing
+                return existing, 'adopted'
+            except Exception as e:
+                last_error = e
+                self.logger.error(f'Error connecting to voice (attempt {attempt + 1}): {type(e).__name__}: {e}')
+
+                if attempt < self.retries - 1:
+                    # Usually the voice server not being ready yet (IndexError from discord.py), back off
+                    await asyncio.sleep(self.backoff.delay(attempt))
+
+        raise VoiceConnectError(f'Could not connect after {self.retries} attempts: {last_error}')
+
+    def _find_existing(self) -> Any:
+        for vc in getattr(self.bot, 'voice_clients', ()):
+            if vc.guild.id == self.guild_id and vc.is_connected():
+                return vc
+        return None
+
+    async def _force_disconnect(self, voice: Any) -> None:
+        try:
+            await voice.disconnect(force=True)
+        except Exception:
+            pass
+
+    def release(self) -> None:
+        """Nothing left to play, disconnect if nothing else is played within the grace period"""
+        if self.client is None:
+            return
+
+        self._cancel_idle()
+        if self.idle_timeout <= 0:
+            asyncio.get_event_loop().create_task(self.disconnect())
+            return
+
+        self.logger.debug('Voice idle, disconnecting in %.0fs', self.idle_timeout)
+        self._idle_handle = asyncio.get_event_loop().call_later(self.idle_timeout, self._idle_expired)
+
+    def _idle_expired(self) -> None:
+        self._idle_handle = None
+
+        voice = self.client
+        if voice is None or voice.is_playing() or voice.is_paused():
+            return
+
+        VOICE_IDLE_DISCONNECTS.inc()
+        self.logger.info('Disconnecting from voice after idling')
+        asyncio.get_event_loop().create_task(self.disconnect())
+
+    def _cancel_idle(self) -> None:
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    async def disconnect(self, force: bool = False) -> None:
+        self._cancel_idle()
+
+        voice, self._client = self._client, None
+        if voice is None:
+            return
+
+        try:
+            await voice.disconnect(force=force)
+        except Exception as e:
+            self.logger.error(f'Error disconnecting from voice: {str(e)}')
+
+    def __repr__(self) -> str:
+        return f'VoiceManager[guild={self.guild_id}, channel={self.channel_id}, idle={self.idle}]'
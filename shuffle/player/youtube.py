@@ -1,7 +1,13 @@
 import os
+import re
+import copy
+import asyncio
+import itertools
+import threading
 import logging
-from typing import List, Callable
+from typing import List, Callable, Optional, Dict, Any, AsyncIterator
 from dataclasses import dataclass
+from urllib.parse import urlparse, parse_qs
 import random
 import string
 import time
@@ -9,14 +15,155 @@ import time
 import yt_dlp as youtube_dl
 
 from shuffle.log import shuffle_logger
+from shuffle.player.cache import LRUCache
 from shuffle.player.models.Track import Track
+from shuffle.player.singleflight import SingleFlight
 from shuffle.player.stream import Stream
+from shuffle.player.ytdl_pool import YoutubeDLPool, get_pool
+from shuffle.admission import AdmissionControl, BACKGROUND, INTERACTIVE, get_admission
+from shuffle.metrics import registry
+from shuffle import tracing
 from shuffle.constants import PROJECT_ROOT
 
-class YoutubeStream(Stream):
-    def __init__(self, guild_id: int) -> None:
-        super().__init__(guild_id)
+# Resolved metadata is stable, keep it for a while
+TRACK_CACHE_SIZE = 2048
+TRACK_CACHE_TTL = 6 * 60 * 60
+
+# Audio URLs are signed and expire, keep them until shortly before googlevideo's expiry
+AUDIO_URL_CACHE_SIZE = 1024
+AUDIO_URL_FALLBACK_TTL = 60 * 60
+AUDIO_URL_EXPIRY_MARGIN = 10 * 60
+
+
+@dataclass(frozen=True)
+class TrackInfo:
+    """Resolved metadata for a video, independent of the (expiring) audio URL"""
+    id: str
+    title: str
+    web_url: str
+    duration: int = -1
+    format_id: Optional[str] = None
+
+
+# Shared across all guilds
+_track_cache: LRUCache[TrackInfo] = LRUCache(maxsize=TRACK_CACHE_SIZE, ttl=TRACK_CACHE_TTL)
+_audio_url_cache: LRUCache[str] = LRUCache(maxsize=AUDIO_URL_CACHE_SIZE)
+
+# Identical lookups in flight at the same time (from any guild) share one extraction
+_inflight: SingleFlight[Track] = SingleFlight()
+
+GET_TRACK_SECONDS = registry.histogram(
+    'shuffle_get_track_seconds', 'Time to resolve a query to a playable track, on a pool thread', ('result',)
+)
+GET_TRACK_ERRORS = registry.counter(
+    'shuffle_get_track_errors_total', 'Failed track resolutions by reason', ('reason',)
+)
+
+def _cache_stat(key: str) -> Callable[[], List[Any]]:
+    return lambda: [(('tracks',), _track_cache.stats[key]), (('audio_urls',), _audio_url_cache.stats[key])]
+
+registry.gauge_callback('shuffle_track_cache_size', 'Entries in the resolved track caches', _cache_stat('size'), ('cache',))
+registry.gauge_callback('shuffle_track_cache_max_size', 'Capacity of the resolved track caches', _cache_stat('maxsize'), ('cache',))
+registry.counter_callback('shuffle_track_cache_hits_total', 'Resolved track cache hits', _cache_stat('hits'), ('cache',))
+registry.counter_callback('shuffle_track_cache_misses_total', 'Resolved track cache misses', _cache_stat('misses'), ('cache',))
+registry.counter_callback('shuffle_track_cache_evictions_total', 'Entries dropped to stay under the cache size', _cache_stat('evictions'), ('cache',))
+registry.counter_callback('shuffle_track_cache_expirations_total', 'Entries dropped after their TTL', _cache_stat('expirations'), ('cache',))
+
+registry.gauge_callback('shuffle_lookups_inflight', 'Distinct track lookups currently running', lambda: [((), _inflight.stats['inflight'])])
+registry.counter_callback('shuffle_lookups_started_total', 'Track lookups that ran an extraction', lambda: [((), _inflight.stats['started'])])
+registry.counter_callback('shuffle_lookups_coalesced_total', 'Track lookups that joined one already in flight', lambda: [((), _inflight.stats['coalesced'])])
+
+
+VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com')
+YOUTUBE_PATH_PREFIXES = ('shorts', 'embed', 'live', 'v')
+
+# Placeholder titles of playlist entries that can't be played
+UNAVAILABLE_TITLES = ('[Private video]', '[Deleted video]')
+
+
+def audio_url_is_fresh(audio_url: str) -> bool:
+    if not audio_url:
+        return False
+
+    expires_at = audio_url_expiry(audio_url)
+    return expires_at is None or expires_at - AUDIO_URL_EXPIRY_MARGIN > time.time()
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+def watch_url(video_id: str) -> str:
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+def is_url(query: str) -> bool:
+    parsed = urlparse(query.strip())
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
+
+
+def parse_video_id(query: str) -> Optional[str]:
+    """Get the video id from a bare id or a youtube.com / youtu.be link"""
+    query = query.strip()
+    if VIDEO_ID_PATTERN.match(query):
+        return query
+
+    parsed = urlparse(query)
+    host = (parsed.hostname or '').lower()
+    candidate = ''
+
+    if host == 'youtu.be':
+        candidate = parsed.path.strip('/').split('/')[0]
+    elif host in YOUTUBE_HOSTS:
+        if parsed.path == '/watch':
+            candidate = parse_qs(parsed.query).get('v', [''])[0]
+        else:
+            parts = parsed.path.strip('/').split('/')
+            if len(parts) >= 2 and parts[0] in YOUTUBE_PATH_PREFIXES:
+                candidate = parts[1]
+
+    return candidate if VIDEO_ID_PATTERN.match(candidate) else None
+
+
+def parse_playlist_id(query: str) -> Optional[str]:
+    """Get the list id from a youtube.com/playlist link (watch links with a list still play one video)"""
+    parsed = urlparse(query.strip())
+    if (parsed.hostname or '').lower() not in YOUTUBE_HOSTS or parsed.path != '/playlist':
+        return None
+
+    list_ids = parse_qs(parsed.query).get('list')
+    return list_ids[0] if list_ids else None
+
+
+def cache_key(query: str) -> str:
+    """Key tracks by video id when the query names one, so links and ids share entries"""
+    video_id = parse_video_id(query)
+    return video_id if video_id is not None else normalize_query(query)
+
 
+def audio_url_expiry(audio_url: str) -> Optional[float]:
+    """Get the expiry timestamp signed into a googlevideo URL, if any"""
+    parsed = urlparse(audio_url)
+
+    expire = parse_qs(parsed.query).get('expire')
+    if expire:
+        value = expire[0]
+    else:
+        # Manifest style URLs carry parameters in the path: /expire/<ts>/...
+        parts = parsed.path.split('/')
+        if 'expire' not in parts or parts.index('expire') + 1 >= len(parts):
+            return None
+        value = parts[parts.index('expire') + 1]
+
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+class YoutubeStream(Stream):
+    def __init__(self, pool_size: int = 4, admission: Optional[AdmissionControl] = None) -> None:
         self.logger = shuffle_logger('youtube')
         self.savedir = 'db/audio'
         
@@ -29,7 +176,7 @@ class YoutubeStream(Stream):
             'extract_flat': False,
             'skip_download': True,
             'ignoreerrors': False,
-            'no_playlist': True,
+            'noplaylist': True,
             # Use different extractor approaches
             'extractor_args': {
                 'youtube': {
@@ -38,30 +185,15 @@ class YoutubeStream(Stream):
             }
         }
 
-    def download(self, video_hash: str, path: str) -> None:
-        actual_url = f'https://www.youtube.com/watch?v={video_hash}'
-        self.logger.info(f'Downloading {actual_url}')
-        if not os.path.exists(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-        
-        opts = self._base_opts.copy()
-        opts.update({
-            'outtmpl': path,
-            'skip_download': False,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }]
-        })
-        
-        with youtube_dl.YoutubeDL(opts) as ydl:
-            ydl.download([actual_url])
+        # Extraction instances are shared with anything else extracting in this process
+        self._pool: YoutubeDLPool = get_pool('search', self._search_opts, size=pool_size)
+        self._download_pool: YoutubeDLPool = get_pool('download', self._download_opts, size=1)
 
-    def get_track(self, query: str) -> Track:
-        """Get track info with better error handling"""
-        
-        # Create options for this specific request
+        # Caps concurrent extractions per guild and overall, None for no limit
+        self._admission = admission
+
+    def _search_opts(self) -> dict:
+        # Create options for a pooled instance
         opts = self._base_opts.copy()
         
         # Rotate user agents
@@ -78,65 +210,335 @@ class YoutubeStream(Stream):
         if os.path.exists(cookie_file):
             opts['cookiefile'] = cookie_file
             self.logger.debug("Using cookies file")
+
+        return opts
+
+    def _download_opts(self) -> dict:
+        opts = self._search_opts()
+        # Keep the original audio stream, the cache encodes it for playback
+        opts.update({
+            'format': 'bestaudio/best',
+            'skip_download': False,
+        })
+        return opts
+
+    def download(self, video_hash: str, path: str) -> None:
+        actual_url = f'https://www.youtube.com/watch?v={video_hash}'
+        self.logger.info(f'Downloading {actual_url}')
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        def run(ydl: Any) -> None:
+            # Output template is the only per-call option
+            ydl.params['outtmpl']['default'] = path
+            ydl.download([actual_url])
+
+        self._download_pool.run(run)
+
+    def get_track(self, query: str) -> Track:
+        """Get track info with better error handling"""
+
+        track = self._get_cached_track(query)
+        if track is not None:
+            return track
+
+        return self._pool.run(lambda ydl: self._timed_get_track(ydl, query))
+
+    async def _acquire(self, guild_id: int, priority: int) -> Callable[[], None]:
+        if self._admission is None:
+            return lambda: None
+        return await self._admission.acquire(guild_id, priority)
+
+    async def _extract(self, guild_id: int, query: str, priority: int) -> Track:
+        release = await self._acquire(guild_id, priority)
+        try:
+            tracing.mark('extract_slot')
+            track = await self._pool.run_async(lambda ydl: self._timed_get_track(ydl, query))
+            tracing.mark('extracted')
+            return track
+        finally:
+            release()
+
+    async def fetch_track(self, guild_id: int, query: str, priority: int = INTERACTIVE) -> Track:
+        # Cache hits are answered on the event loop without touching the pool
+        track = self._get_cached_track(query)
+        if track is not None:
+            tracing.mark('cache_hit')
+            return track
+
+        # The first caller's guild and priority decide when a coalesced lookup gets a slot
+        track = await _inflight.do(cache_key(query), lambda: self._extract(guild_id, query, priority))
+
+        # Every caller gets its own copy, tracks are bound to a guild's channel later
+        return copy.copy(track) if track is not None else None
+
+    async def refresh_track(self, guild_id: int, track: Track, priority: int = INTERACTIVE) -> bool:
+        if audio_url_is_fresh(track.audio_url):
+            return True
+
+        # Another guild may have refreshed it already, otherwise resolve by id (no search)
+        self.logger.debug('Audio URL for %s is stale, refreshing', track.id)
+        fresh = await self.fetch_track(guild_id, track.id, priority)
+        if fresh is None:
+            self.logger.error(f'Failed to refresh audio URL for {track.title} [{track.id}]')
+            return False
+
+        track.audio_url = fresh.audio_url
+        return True
+
+    def is_playlist(self, query: str) -> bool:
+        return parse_playlist_id(query) is not None
+
+    async def stream_playlist(self, guild_id: int, query: str, limit: int = 200,
+                              batch_size: int = 25) -> AsyncIterator[List[Track]]:
+        """Expand a playlist with flat extraction, yielding unresolved tracks in batches as pages arrive.
+
+        The first track is yielded on its own so playback can start right away, formats are
+        resolved later (see refresh_track) when each track is about to play.
+        """
+        loop = asyncio.get_event_loop()
+        batches: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def produce(ydl: Any, skip: int, first_only: bool) -> Optional[int]:
+            """Queue batches of the entries from `skip` on. With `first_only`, stops after the
+            first track and returns the entry to continue from, otherwise returns None"""
+            try:
+                # process=False keeps entries as lazily paged, unresolved references
+                info = ydl.extract_info(query, download=False, process=False)
+                for _ in range(3):
+                    if not info or info.get('_type') not in ('url', 'url_transparent'):
+                        break
+                    info = ydl.extract_info(info['url'], download=False, process=False)
+
+                batch: List[Track] = []
+                entries = itertools.islice((info or {}).get('entries') or [], skip, limit)
+                for position, entry in enumerate(entries, skip):
+                    if stopped.is_set():
+                        return None
+
+                    track = self._make_flat_track(entry, query)
+                    if track is None:
+                        continue
+
+                    batch.append(track)
+                    if first_only:
+                        loop.call_soon_threadsafe(batches.put_nowait, batch)
+                        return position + 1
+
+                    if len(batch) >= batch_size:
+                        loop.call_soon_threadsafe(batches.put_nowait, batch)
+                        batch = []
+
+                if batch:
+                    loop.call_soon_threadsafe(batches.put_nowait, batch)
+            except youtube_dl.utils.DownloadError as e:
+                self.logger.error(f'Playlist download error: {str(e)}')
+            except Exception as e:
+                self.logger.error(f'Unexpected error expanding playlist: {str(e)}')
+
+            return None
+
+        async def run(priority: int, skip: int, first_only: bool) -> Optional[int]:
+            release = await self._acquire(guild_id, priority)
+            try:
+                future = self._pool.submit(lambda ydl: produce(ydl, skip, first_only))
+            except BaseException:
+                release()
+                raise
+            # Held until the thread is done, even if we stop waiting for it
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(release))
+            return await asyncio.wrap_future(future)
+
+        async def expand() -> None:
+            try:
+                # A user is waiting on the first track only. The rest is background work, in a
+                # job of its own so it waits behind play commands instead of holding their slots
+                # (it fetches the first page again, the pages can't move to another instance)
+                resume_at = await run(INTERACTIVE, 0, True)
+                if resume_at is not None and not stopped.is_set():
+                    await run(BACKGROUND, resume_at, False)
+            except Exception as e:
+                self.logger.error(f'Unexpected error expanding playlist: {str(e)}')
+            finally:
+                batches.put_nowait(None)
+
+        task = loop.create_task(expand())
+        try:
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            stopped.set()
+            task.cancel()
+
+    def _make_flat_track(self, entry: dict, query: str) -> Optional[Track]:
+        if not entry or not entry.get('id') or entry.get('title') in UNAVAILABLE_TITLES:
+            return None
+
+        # No audio URL yet, it's resolved by id right before playing
+        return Track(
+            id=entry['id'],
+            title=entry.get('title') or 'Unknown Title',
+            query=query,
+            web_url=watch_url(entry['id']),
+            audio_url='',
+            duration=int(entry.get('duration') or -1)
+        )
+
+    def _get_cached_track(self, query: str) -> Optional[Track]:
+        info = _track_cache.get(cache_key(query))
+        if info is None:
+            return None
+
+        audio_url = _audio_url_cache.get(info.id)
+        if audio_url is None:
+            return None
+
+        self.logger.debug('Cache hit for query: %s [%s]', query, info.id)
+        return self._make_track(info, query, audio_url)
+
+    def _timed_get_track(self, ydl: Any, query: str) -> Track:
+        started_at = time.perf_counter()
+        track = None
+        try:
+            track = self._get_track(ydl, query)
+            return track
+        finally:
+            GET_TRACK_SECONDS.observe(time.perf_counter() - started_at, 'ok' if track is not None else 'error')
+
+    def _get_track(self, ydl: Any, query: str) -> Track:
+        info = _track_cache.get(cache_key(query))
+
+        if info is not None:
+            audio_url = _audio_url_cache.get(info.id)
+            if audio_url is not None:
+                self.logger.debug('Cache hit for query: %s [%s]', query, info.id)
+                return self._make_track(info, query, audio_url)
+
+            # Metadata is known, only the audio URL needs to be refreshed
+            self.logger.debug('Audio URL expired for %s, re-extracting', info.id)
+            return self._resolve(ydl, query, info.web_url)
+
+        # Links and video ids skip the search entirely
+        video_id = parse_video_id(query)
+        if video_id is not None:
+            track = self._resolve(ydl, query, watch_url(video_id))
+            if track is not None or is_url(query):
+                return track
+
+            # A bare 11 character query might just be a search term
+            self.logger.debug('Could not resolve %s as a video id, searching instead', query)
+        elif is_url(query):
+            return self._resolve(ydl, query, query.strip())
+
+        return self._resolve(ydl, query)
+
+    def _resolve(self, ydl: Any, query: str, video_url: Optional[str] = None) -> Track:
+        """Resolve a query (or a known video URL) to a playable track"""
         
         try:
-            with youtube_dl.YoutubeDL(opts) as ydl:
+            video_info: Any = None
+            audio_format: Optional[dict] = None
+
+            if video_url is None:
                 # Search for the video
-                self.logger.debug(f"Searching for: {query}")
+                self.logger.debug("Searching for: %s", query)
                 result = ydl.extract_info(f"ytsearch:{query}", download=False)
                 
                 if not result or 'entries' not in result or not result['entries']:
                     self.logger.error(f"No results found for query: {query}")
+                    GET_TRACK_ERRORS.inc('no_results')
                     return None
                 
                 # Get first result
                 entry = result['entries'][0]
-                
+                video_url = watch_url(entry['id'])
+
+                # Search results are usually fully extracted already, use their formats if so
+                if entry.get('_type', 'video') == 'video' and (entry.get('formats') or entry.get('url')):
+                    video_info = entry
+                    audio_format = self._select_audio_format(entry)
+            
+            if audio_format is None:
                 # Extract info for the specific video to get formats
-                video_url = f"https://www.youtube.com/watch?v={entry['id']}"
-                self.logger.debug(f"Extracting info for: {video_url}")
+                self.logger.debug("Extracting info for: %s", video_url)
                 
                 # Let yt-dlp handle format selection automatically
                 video_info = ydl.extract_info(video_url, download=False)
+                if video_info and video_info.get('entries'):
+                    video_info = video_info['entries'][0]
                 
-                # Get the best audio URL
-                audio_url = self._extract_audio_url(video_info)
-                
-                if not audio_url:
-                    self.logger.error(f"Failed to extract audio URL")
-                    return None
-                
-                return Track(
-                    id=video_info.get('id', 'unknown'),
-                    title=video_info.get('title', 'Unknown Title'),
-                    query=query,
-                    web_url=video_url,
-                    audio_url=audio_url,
-                    duration=video_info.get('duration', -1)
-                )
-                
+                # Get the best audio format
+                audio_format = self._select_audio_format(video_info)
+            
+            if not audio_format:
+                self.logger.error("Failed to extract audio URL")
+                GET_TRACK_ERRORS.inc('no_format')
+                return None
+
+            info = TrackInfo(
+                id=video_info.get('id', 'unknown'),
+                title=video_info.get('title', 'Unknown Title'),
+                web_url=video_url,
+                duration=int(video_info.get('duration') or -1),
+                format_id=audio_format.get('format_id')
+            )
+            self._cache(query, info, audio_format['url'])
+
+            return self._make_track(info, query, audio_format['url'])
+            
         except youtube_dl.utils.DownloadError as e:
             error_msg = str(e)
             if 'Sign in to confirm' in error_msg:
                 self.logger.error("YouTube requires sign-in. Consider using cookies.")
+                GET_TRACK_ERRORS.inc('sign_in')
             elif '403' in error_msg:
                 self.logger.error("Got 403 error. YouTube is blocking requests.")
+                GET_TRACK_ERRORS.inc('forbidden')
             else:
                 self.logger.error(f"Download error: {error_msg}")
+                GET_TRACK_ERRORS.inc('download_error')
             return None
         except Exception as e:
             self.logger.error(f"Unexpected error: {str(e)}")
+            GET_TRACK_ERRORS.inc('error')
             import traceback
             self.logger.error(traceback.format_exc())
             return None
 
-    def _extract_audio_url(self, info_dict: dict) -> str:
-        """Extract the best audio URL from video info"""
+    def _cache(self, query: str, info: TrackInfo, audio_url: str) -> None:
+        _track_cache.set(cache_key(query), info)
+        _track_cache.set(info.id, info)
+
+        expires_at = audio_url_expiry(audio_url)
+        if expires_at is None:
+            expires_at = time.time() + AUDIO_URL_FALLBACK_TTL
+        else:
+            expires_at -= AUDIO_URL_EXPIRY_MARGIN
+
+        if expires_at > time.time():
+            _audio_url_cache.set(info.id, audio_url, expires_at=expires_at)
+
+    def _make_track(self, info: TrackInfo, query: str, audio_url: str) -> Track:
+        return Track(
+            id=info.id,
+            title=info.title,
+            query=query,
+            web_url=info.web_url,
+            audio_url=audio_url,
+            duration=info.duration
+        )
+
+    def _select_audio_format(self, info_dict: dict) -> Optional[dict]:
+        """Select the best audio format (with a URL) from video info"""
         
         # Check if yt-dlp already selected a URL for us
         if 'url' in info_dict and info_dict['url']:
             self.logger.debug("Using URL selected by yt-dlp")
-            return info_dict['url']
+            return info_dict
         
         # Otherwise look through formats
         formats = info_dict.get('formats', [])
@@ -146,13 +548,13 @@ class YoutubeStream(Stream):
             requested_formats = info_dict.get('requested_formats', [])
             if requested_formats and requested_formats[0].get('url'):
                 self.logger.debug("Using URL from requested_formats")
-                return requested_formats[0]['url']
+                return requested_formats[0]
             
             self.logger.warning("No formats found in video info")
             return None
         
         # Log available formats for debugging
-        self.logger.debug(f"Total formats available: {len(formats)}")
+        self.logger.debug("Total formats available: %s", len(formats))
         
         # Try to find audio-only formats first
         audio_only_formats = []
@@ -202,7 +604,20 @@ class YoutubeStream(Stream):
             f"audio={best_format.get('acodec', 'unknown')} @ {best_format.get('abr', 'unknown')}kbps"
         )
         
-        return best_format.get('url')
+        return best_format
 
     def is_ready(self) -> bool:
-        return True
\ No newline at end of file
+        return True
+
+
+_stream: Optional[YoutubeStream] = None
+_stream_lock = threading.Lock()
+
+def get_youtube_stream(config: dict) -> YoutubeStream:
+    """Get the process-wide YouTube stream, every guild's player uses the same one"""
+    global _stream
+
+    with _stream_lock:
+        if _stream is None:
+            _stream = YoutubeStream(pool_size=config.get('ytdl_pool_size', 4), admission=get_admission(config))
+        return _stream
@@ -0,0 +1,157 @@
+import asyncio
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple, TypeVar
+
+import yt_dlp as youtube_dl # type: ignore
+
+from shuffle.log import shuffle_logger
+from shuffle.metrics import registry
+
+T = TypeVar('T')
+
+POOL_QUEUE_SECONDS = registry.histogram(
+    'shuffle_ytdl_queue_wait_seconds', 'Time a job waited for a free pool thread', ('pool',)
+)
+POOL_RUN_SECONDS = registry.histogram(
+    'shuffle_ytdl_run_seconds', 'Time a job held a YoutubeDL instance', ('pool',)
+)
+POOL_FAILURES = registry.counter(
+    'shuffle_ytdl_failures_total', 'Pool jobs that raised', ('pool',)
+)
+
+class YoutubeDLPool:
+    """Long-lived YoutubeDL instances served by a dedicated, size-capped thread pool.
+
+    Each worker thread borrows one instance for the duration of a call, so extractors,
+    HTTP connections and the cookie jar are built once and reused across requests.
+    """
+
+    def __init__(self, opts_factory: Callable[[], dict], size: int = 4, name: str = 'ytdl') -> None:
+        if size <= 0:
+            raise ValueError('pool size must be positive')
+
+        self.name = name
+        self.size = size
+        self.logger = shuffle_logger(f'ytdl_pool.{name}')
+
+        self._opts_factory = opts_factory
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'ytdl-{name}')
+
+        # LIFO so the most recently used (warmest) instance is handed out first
+        self._idle: 'queue.LifoQueue[Any]' = queue.LifoQueue()
+        self._instances = 0
+        self._cookiejar: Any = None
+        self._lock = threading.Lock()
+
+        self._pending = 0
+        self._active = 0
+
+    def _create(self) -> Any:
+        ydl = youtube_dl.YoutubeDL(self._opts_factory())
+
+        # Load the cookie jar from disk once and share it, CookieJar is internally locked
+        with self._lock:
+            cookiejar = self._cookiejar
+        if cookiejar is None:
+            cookiejar = ydl.cookiejar
+            with self._lock:
+                if self._cookiejar is None:
+                    self._cookiejar = cookiejar
+                cookiejar = self._cookiejar
+        ydl.__dict__['cookiejar'] = cookiejar
+
+        self.logger.debug('Created YoutubeDL instance %s/%s', self._instances, self.size)
+        return ydl
+
+    def _acquire(self) -> Any:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._instances < self.size
+            if create:
+                self._instances += 1
+
+        if create:
+            return self._create()
+
+        return self._idle.get()
+
+    def _release(self, ydl: Any) -> None:
+        self._idle.put(ydl)
+
+    def submit(self, fn: Callable[[Any], T]) -> 'Future[T]':
+        """Run fn(ydl) on the pool, returns a concurrent future"""
+        submitted_at = time.monotonic()
+
+        with self._lock:
+            self._pending += 1
+
+        def task() -> T:
+            started_at = time.monotonic()
+            POOL_QUEUE_SECONDS.observe(started_at - submitted_at, self.name)
+
+            with self._lock:
+                self._pending -= 1
+                self._active += 1
+
+            ydl = self._acquire()
+            try:
+                return fn(ydl)
+            except Exception:
+                POOL_FAILURES.inc(self.name)
+                raise
+            finally:
+                self._release(ydl)
+                POOL_RUN_SECONDS.observe(time.monotonic() - started_at, self.name)
+                with self._lock:
+                    self._active -= 1
+
+        return self._executor.submit(task)
+
+    def run(self, fn: Callable[[Any], T]) -> T:
+        return self.submit(fn).result()
+
+    async def run_async(self, fn: Callable[[Any], T]) -> T:
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __repr__(self) -> str:
+        return f'YoutubeDLPool[name={self.name}, size={self.size}, instances={self._instances}]'
+
+
+_pools: Dict[str, YoutubeDLPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(name: str, opts_factory: Callable[[], dict], size: int = 4) -> YoutubeDLPool:
+    """Get the process-wide pool with this name, creating it on first use"""
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = YoutubeDLPool(opts_factory, size=size, name=name)
+        return _pools[name]
+
+
+def _collect(attr: str) -> Callable[[], List[Tuple[Tuple[str, ...], float]]]:
+    def collect() -> List[Tuple[Tuple[str, ...], float]]:
+        with _pools_lock:
+            pools = list(_pools.values())
+        return [((pool.name,), getattr(pool, attr)) for pool in pools]
+    return collect
+
+registry.gauge_callback('shuffle_ytdl_pool_size', 'Threads (and YoutubeDL instances) a pool may use', _collect('size'), ('pool',))
+registry.gauge_callback('shuffle_ytdl_instances', 'YoutubeDL instances created so far', _collect('_instances'), ('pool',))
+registry.gauge_callback('shuffle_ytdl_pending', 'Jobs waiting for a pool thread', _collect('_pending'), ('pool',))
+registry.gauge_callback('shuffle_ytdl_active', 'Jobs running on a pool thread', _collect('_active'), ('pool',))
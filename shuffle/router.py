@@ -0,0 +1,113 @@
+import asyncio
+import time
+import logging
+
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from shuffle.metrics import Histogram
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    handler: Callable[..., Awaitable[Any]]
+    argmin: int = 0
+    usage: Optional[str] = None
+    admin: bool = False
+    disabled: bool = False
+
+
+class CommandRouter:
+    """Maps command names and aliases to handlers, resolved once from the commands file.
+
+    Everything `on_message` used to work out per message (alias lookup, handler,
+    permission, argument minimum, disabled flag) is precomputed into a `Route`, so
+    routing a message is a prefix check and one dict lookup. Each route gets a latency
+    histogram.
+    """
+
+    def __init__(self, commands: Dict[str, dict], target: Any, admin_ids: Iterable[Any] = (),
+                 logger: Optional[logging.Logger] = None) -> None:
+        self.logger = logger or logging.getLogger(__name__)
+        self.admin_ids: FrozenSet[int] = frozenset(int(i) for i in admin_ids)
+
+        self.routes: Dict[str, Route] = {}
+        self.latency: Dict[str, Histogram] = {}
+
+        self.rejected = 0
+        self.unknown = 0
+
+        self._build(commands, target)
+
+    def _build(self, commands: Dict[str, dict], target: Any) -> None:
+        aliases: List[Tuple[str, str]] = []
+
+        for name, data in commands.items():
+            method_name = data.get('function', name)
+            handler = getattr(target, method_name, None)
+            if handler is None:
+                self.logger.error(f'could not find function to call for command: {name}')
+                continue
+            if not asyncio.iscoroutinefunction(handler):
+                self.logger.error(f'function not coroutine for command: {name}')
+                continue
+
+            # Only 'admin' is enforced, other permission tags are informational for now
+            permission = (data.get('permission') or 'any').lower()
+
+            self.routes[name] = Route(
+                name=name,
+                handler=handler,
+                argmin=data.get('argmin', 0),
+                usage=data.get('usage'),
+                admin=permission == 'admin',
+                disabled=data.get('disabled') == 1
+            )
+            self.latency[name] = Histogram()
+            aliases.extend((alias, name) for alias in data.get('aliases', []))
+
+        for alias, name in aliases:
+            if alias in self.routes:
+                self.logger.warning(f'Alias {alias} of {name} shadows a command, ignoring it')
+                continue
+            self.routes[alias] = self.routes[name]
+
+    def match(self, content: str, prefix: str) -> Optional[Tuple[str, Optional[Route], List[str]]]:
+        """Split a message into (command, route, args), None if it isn't a command.
+
+        The route is None for unknown commands. Chat that merely starts with the prefix
+        ("!!!", "% of them") is rejected without splitting the message.
+        """
+        if not content.startswith(prefix):
+            # Rare, but commands used to be accepted after leading whitespace
+            if not content[:1].isspace():
+                return None
+            content = content.lstrip()
+            if not content.startswith(prefix):
+                return None
+
+        start = len(prefix)
+        if len(content) <= start or not content[start].isalnum():
+            self.rejected += 1
+            return None
+
+        command, *args = content[start:].split()
+
+        route = self.routes.get(command)
+        if route is None:
+            self.unknown += 1
+        return command, route, args
+
+    def is_allowed(self, route: Route, user_id: int) -> bool:
+        return not route.admin or user_id in self.admin_ids
+
+    async def dispatch(self, route: Route, *args: Any) -> Any:
+        """Run the route's handler, recording its latency"""
+        started_at = time.perf_counter()
+        try:
+            return await route.handler(*args)
+        finally:
+            self.latency[route.name].observe(time.perf_counter() - started_at)
+
+    def __repr__(self) -> str:
+        return f'CommandRouter[commands={len(self.latency)}, routes={len(self.routes)}]'
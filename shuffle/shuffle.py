@@ -1,33 +1,67 @@
 import logging
 import json
 import asyncio
+import math
 import os
+import time
 import traceback
 
 import discord
 from discord.ext import commands
 
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 
 from shuffle.player.player import Player
+from shuffle.player.models.Queue import QueueFullException
+from shuffle.player.youtube import is_url
+from shuffle.player.audio_cache import get_audio_cache
+from shuffle.database.snapshots import get_snapshot_store
+from shuffle.database.stats import get_stats_writer
+from shuffle.database.db import get_database
+from shuffle.database.guilds import GuildConfigs
+from shuffle.router import CommandRouter
+from shuffle.admission import get_admission
+from shuffle.metrics import registry, start_metrics_server
+from shuffle.tracing import get_tracer
+from shuffle.log import configure_logging, shuffle_logger
 from shuffle.constants import GOD_IDS
 
-
-class ShuffleRebootException(Exception):
-    ...
+PLAYERS_EVICTED = registry.counter(
+    'shuffle_players_evicted_total', 'Players dropped after idling for the TTL, their queues checkpointed'
+)
 
 class ShuffleBot(commands.Cog):
-    def __init__(self, bot: commands.Bot, logger: logging.Logger, env: str = 'dev'):
+    def __init__(self, bot: Union[commands.Bot, commands.AutoShardedBot], logger: logging.Logger, env: str = 'dev',
+                 overrides: Optional[dict] = None):
         self.bot = bot
         self.logger = logger
 
         self.players: Dict[int, Player] = {}
+        # Players still loading their queue snapshot
+        self._restoring: Dict[int, asyncio.Task] = {}
+
+        # Drops players of guilds that went quiet, see _sweep_players
+        self._sweeper: Optional[asyncio.Task] = None
+
+        # Set by the restart command, the worker process exits so the supervisor starts a fresh one
+        self.reboot_requested = False
 
         self._env = env
         self._update_config()
-        self.logger.debug(f'Loaded config: {self._env}, prefix: {self.config["prefix"]}')
-
-        commands_file = f'shuffle/shuffle.json'
+        # Per-process settings from the launcher (metrics port, cache directory of this worker)
+        self.config.update(overrides or {})
+        configure_logging(self.config)
+        self.logger.debug('Loaded config: %s, prefix: %s', self._env, self.config["prefix"])
+
+        # Per-guild settings (prefix, limits), the config values are the defaults
+        self.guild_configs = GuildConfigs(
+            self.config,
+            get_database(self.config, logger=logger),
+            maxsize=self.config.get('guild_cache_size', 10000),
+            logger=logger
+        )
+
+        commands_file = 'shuffle/shuffle.json'
         if not os.path.isfile(commands_file):
             raise Exception(f'Commands file not found: {commands_file}')
         self.commands_file = commands_file
@@ -40,97 +74,151 @@ class ShuffleBot(commands.Cog):
 
         self.helper = ShuffleHelp(commands=self.commands)
 
+        # Rate limits for expensive commands, shared with the players' extraction caps
+        self.admission = get_admission(self.config)
+
+        # Names and aliases resolved to handlers once, instead of per message
+        self.router = CommandRouter(self.commands, self, admin_ids=GOD_IDS, logger=logger)
+
+        # Play requests traced from the command to the first audio frame
+        self.tracer = get_tracer(self.config, logger=shuffle_logger('trace'))
+
+        self._register_metrics()
+
         self.logger.debug('Done creating ShuffleBot')
 
 
+    async def cog_load(self):
+        if self.config.get('player_idle_ttl', 1800) > 0:
+            self._sweeper = asyncio.get_event_loop().create_task(self._sweep_players())
+
+        if self.config.get('metrics', True):
+            try:
+                await start_metrics_server(self.config.get('metrics_host', '127.0.0.1'), self.config.get('metrics_port', 9108))
+            except Exception as e:
+                self.logger.error(f'Could not start metrics server: {str(e)}')
+
+    def _register_metrics(self):
+        # Callbacks are read at scrape time, registering again after a restart points them at this cog
+        registry.gauge_callback(
+            'shuffle_players_active', 'Players in memory (guilds active within the idle TTL)',
+            lambda: [((), len(self.players))]
+        )
+        registry.gauge_callback(
+            'shuffle_voice_clients_connected', 'Voice clients currently connected',
+            lambda: [((), sum(1 for vc in self.bot.voice_clients if vc.is_connected()))]
+        )
+        registry.gauge_callback(
+            'shuffle_voice_clients_idle', 'Voice clients kept open after playback stopped, waiting for the next track',
+            lambda: [((), sum(1 for player in list(self.players.values()) if player.voice.idle))]
+        )
+        # Totals rather than a series per guild, there can be thousands of guilds
+        registry.gauge_callback(
+            'shuffle_queue_depth', 'Tracks waiting in all guilds\' queues',
+            lambda: [((), sum(len(player.queue) for player in list(self.players.values())))]
+        )
+        registry.gauge_callback(
+            'shuffle_queue_depth_max', 'Tracks waiting in the longest guild queue',
+            lambda: [((), max((len(player.queue) for player in list(self.players.values())), default=0))]
+        )
+
+        registry.gauge_callback(
+            'shuffle_guild_configs_cached', 'Guild settings held in memory',
+            lambda: [((), len(self.guild_configs.prefixes))]
+        )
+        registry.counter_callback(
+            'shuffle_guild_config_loads_total', 'Guild settings loaded from the database (or defaulted)',
+            lambda: [((), self.guild_configs.loads)]
+        )
+        registry.counter_callback(
+            'shuffle_guild_config_evictions_total', 'Guild settings dropped to stay under the cache size',
+            lambda: [((), self.guild_configs.evictions)]
+        )
+        registry.counter_callback(
+            'shuffle_guild_config_invalidations_total', 'Guild settings dropped after a change',
+            lambda: [((), self.guild_configs.invalidations)]
+        )
+
+        commands_seconds = registry.histogram('shuffle_command_seconds', 'Command handler latency', ('command',))
+        for name, histogram in self.router.latency.items():
+            commands_seconds.add(histogram, name)
+        registry.counter_callback(
+            'shuffle_commands_ignored_total', 'Prefixed messages that were not a command, by reason',
+            lambda: [(('rejected',), self.router.rejected), (('unknown',), self.router.unknown)], ('reason',)
+        )
+
     @commands.Cog.listener()
     async def on_ready(self):
         await self.bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=f'{self.config["prefix"]}help'))
         self.logger.info('Bot is ready')
 
+        # Guilds that were mid-song when we went down pick up right away, the rest restore on first use
+        snapshots = get_snapshot_store(self.config)
+        if snapshots is not None:
+            try:
+                for guild_id in await snapshots.playing_guilds():
+                    # Guilds on other shards belong to other workers
+                    if self.bot.get_guild(guild_id) is not None:
+                        await self._get_player(guild_id)
+            except Exception as e:
+                self.logger.error(f'Error restoring playing guilds: {str(e)}')
+
 
     @commands.Cog.listener()
     async def on_message(self, msg: discord.Message):
         try:
-            content = msg.content.strip()
-
-            if not content or content[0] != self.config['prefix']:
+            if msg.author.bot:
                 return
 
-            command_parts = content[1:].split()
-            if not command_parts:
+            prefix = self.guild_configs.default_prefix
+            if msg.guild is not None:
+                # Cached guilds cost one dict lookup, the first message of a guild loads its settings
+                cached_prefix = self.guild_configs.prefixes.get(msg.guild.id)
+                prefix = cached_prefix if cached_prefix is not None else (await self.guild_configs.get(msg.guild.id)).prefix
+
+            match = self.router.match(msg.content, prefix)
+            if match is None:
                 return
-                
-            command = command_parts[0]
-            args = command_parts[1:]
-
-            self.logger.debug(f"Command received: {command} with args: {args} from user: {msg.author.name}")
-
-            for cmd, data in self.commands.items():
-                if 'aliases' in data and command in data['aliases']:
-                    command = cmd
-                    break
-
-            # check for declared command
-            if command in self.commands:
-                # command disabled
-                if 'disabled' in self.commands[command] and self.commands[command]['disabled'] == 1:
-                    self.logger.debug(f"Command {command} is disabled")
-                    return
-
-                # admin
-                if 'permission' in self.commands[command] \
-                    and len(self.commands[command]['permission']) > 0 \
-                    and self.commands[command]['permission'].lower() != 'any':
-                    perm_tag = self.commands[command]['permission'].lower()
-
-                    # need to set up admin permissions....right now just me
-                    if perm_tag == 'admin' and str(msg.author.id) not in GOD_IDS:
-                        await msg.channel.send(f'You are not authorized to run command `{command}`')
-                        return
-
-                # self.logger.debug(f'user {msg.author.display_name} called on: \'{command}\'')
-
-                method_name = command
-
-                if 'function' in self.commands[command]:
-                    method_name = self.commands[command]['function']
-
-                if hasattr(self, method_name):
-                    method = getattr(self, method_name)
-                    if asyncio.iscoroutinefunction(method):
-
-                        # check arg minimum requirement
-                        if 'argmin' in self.commands[command] and len(args) < self.commands[command]['argmin']:
-                            if 'usage' in self.commands[command]:
-                                await msg.channel.send(f'Usage: `{self.config["prefix"]}{command} {self.commands[command]["usage"]}`')
-                            return
-                        
-                        self.logger.debug(f'Executing: \'{command}({" ".join(args)})\'')
-
-                        # Handle DMs properly
-                        if msg.guild is None:
-                            self.logger.info(f'Command received in DM from {msg.author.name}, ignoring')
-                            await msg.channel.send("Sorry, commands only work in servers, not in DMs.")
-                            return
-
-                        try:
-                            player = self._get_player(msg.guild.id)
-                            # Execute command directly with proper error handling
-                            await method(msg, player, *args)
-                        except Exception as e:
-                            error_msg = f'Error executing command {command}: {str(e)}'
-                            self.logger.error(error_msg)
-                            self.logger.error(traceback.format_exc())
-                            # await msg.channel.send(f"Error: {str(e)}")
-                    else:
-                        self.logger.error(f'function not coroutine for command: {command}')
-                else:
-                    self.logger.error(f'could not find function to call for command: {command}')
-            else:
+
+            command, route, args = match
+            self.logger.debug('Command received: %s with args: %s from user: %s', command, args, msg.author.name)
+
+            if route is None:
                 # Command not found, let user know
-                self.logger.debug(f"Unknown command: {command}")
-                await msg.channel.send(f"Unknown command: `{command}`. Try `{self.config['prefix']}help` for a list of commands.")
+                self.logger.debug("Unknown command: %s", command)
+                await msg.channel.send(f"Unknown command: `{command}`. Try `{prefix}help` for a list of commands.")
+                return
+
+            if route.disabled:
+                self.logger.debug("Command %s is disabled", command)
+                return
+
+            # need to set up admin permissions....right now just GOD_IDS
+            if not self.router.is_allowed(route, msg.author.id):
+                await msg.channel.send(f'You are not authorized to run command `{command}`')
+                return
+
+            # check arg minimum requirement
+            if len(args) < route.argmin:
+                if route.usage is not None:
+                    await msg.channel.send(f'Usage: `{prefix}{command} {route.usage}`')
+                return
+
+            self.logger.debug('Executing: \'%s(%s)\'', route.name, ' '.join(args))
+
+            # Handle DMs properly
+            if msg.guild is None:
+                self.logger.info(f'Command received in DM from {msg.author.name}, ignoring')
+                await msg.channel.send("Sorry, commands only work in servers, not in DMs.")
+                return
+
+            try:
+                player = await self._get_player(msg.guild.id)
+                await self.router.dispatch(route, msg, player, *args)
+            except Exception as e:
+                error_msg = f'Error executing command {command}: {str(e)}'
+                self.logger.error(error_msg)
+                self.logger.error(traceback.format_exc())
         except Exception as e:
             # Catch-all for any other errors in command processing
             self.logger.error(f"Unexpected error processing message: {str(e)}")
@@ -144,7 +232,33 @@ class ShuffleBot(commands.Cog):
 
     async def restart(self, ctx: discord.Message, _):
         await ctx.channel.send('Rebooting the bot...')
-        raise ShuffleRebootException
+
+        # Exceptions raised in here never reach the launcher, stop the bot and let it see the flag
+        self.reboot_requested = True
+        await self.shutdown()
+        await self.bot.close()
+
+    async def shutdown(self):
+        """Checkpoint every queue and write buffered stats now rather than after the debounce, we may not be around for it.
+
+        Call before closing the bot, closing disconnects voice and leaves every player idle.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+
+        snapshots = get_snapshot_store(self.config)
+        if snapshots is not None:
+            for player in self.players.values():
+                player.freeze()
+            await snapshots.flush()
+
+        stats = get_stats_writer(self.config)
+        if stats is not None:
+            await stats.flush()
+
+        # Cache hits since the last index write, so recency survives the restart
+        if self.config.get('track_cache', True) and 'download_path' in self.config:
+            await asyncio.get_event_loop().run_in_executor(None, get_audio_cache(self.config).flush)
 
     # Update the play, stop, and resume methods in shuffle.py
 
@@ -159,7 +273,7 @@ class ShuffleBot(commands.Cog):
                 await ctx.channel.send("You need to join a voice channel first!")
                 return
                 
-            self.logger.debug(f'No query provided, attempting to resume playback')
+            self.logger.debug('No query provided, attempting to resume playback')
             
             success = await player.resume(voice_channel)
             if success:
@@ -168,26 +282,57 @@ class ShuffleBot(commands.Cog):
                 await ctx.channel.send("Nothing to resume. Use `-play <song>` to play a song.")
             return
 
-        # Limit query length
-        query = query[:min(len(query), 100)]
+        # Limit query length (links are kept whole)
+        if not is_url(query):
+            query = query[:min(len(query), 100)]
 
         voice_channel = self._get_voice_channel(ctx)
         if voice_channel is None:
             await ctx.channel.send("You need to join a voice channel first!")
             return
 
-        self.logger.debug(f'Searching for query: {query}')   
+        # Finished by the player once the first frame goes out, or here if it never gets that far
+        span = self.tracer.start('play', guild=player.guild.id, query=query)
+
+        # Searches are expensive, checked against the user's and the server's rate before any work
+        retry_after = self.admission.admit(player.guild.id, ctx.author.id)
+        if retry_after:
+            self.logger.debug('Rate limited play from %s, retry in %.1fs', ctx.author.name, retry_after)
+            if span is not None:
+                span.finish('rate_limited')
+            if self.admission.should_notify(ctx.author.id, retry_after):
+                await ctx.channel.send(f'Slow down, try again in {math.ceil(retry_after)}s')
+            return
+
+        self.logger.debug('Searching for query: %s', query)   
 
+        if span is not None:
+            span.mark('admitted')
         message = await ctx.channel.send(f'Searching for `{query}` ...')
+        if span is not None:
+            span.mark('reply_sent')
         try:
+            is_playlist = player.is_playlist(query)
             track = await player.enqueue(query, voice_channel)
             position = player.queue.length
 
-            if position > 0:
+            # Only a track that starts right away has a time to first audio
+            if span is not None and player.queue.current is not track:
+                span.finish('queued')
+
+            if is_playlist:
+                await message.edit(content=f'Queued playlist starting with `{track.title}`, loading the rest in the background')
+            elif position > 0:
                 await message.edit(content=f'Queued `{track.title}` at position {position}')
             else:
                 await message.edit(content=f'Playing `{track.title}`')
+        except QueueFullException as e:
+            if span is not None:
+                span.finish('queue_full')
+            await message.edit(content=f'Could not queue `{query}`: {str(e)}')
         except Exception as e:
+            if span is not None:
+                span.finish('error')
             self.logger.error(f"Error playing {query}: {str(e)}")
             self.logger.error(traceback.format_exc())
             await message.edit(content=f"Error playing `{query}`, contact admin")
@@ -200,7 +345,7 @@ class ShuffleBot(commands.Cog):
         except Exception as e:
             self.logger.error(f"Error pausing playback: {str(e)}")
             self.logger.error(traceback.format_exc())
-            await ctx.channel.send(f"Error pausing playback, contact admin")
+            await ctx.channel.send("Error pausing playback, contact admin")
 
 
     async def resume(self, ctx, player, *args):
@@ -232,7 +377,7 @@ class ShuffleBot(commands.Cog):
             self.logger.error(f"Error skipping track: {str(e)}")
             await ctx.channel.send(f"Error skipping track: {str(e)}")
 
-    # View the queue
+    # View the queue, one page at a time
     async def list(self, ctx, player: Player, *args):
         try:
             current_track = '_none_'
@@ -242,7 +387,13 @@ class ShuffleBot(commands.Cog):
                 else:
                     current_track = '*Unknown track*'
 
-            desc = [f'{i+1}: {t.title}' for i, t in enumerate(player.list())]
+            page_size = self.config.get('list_page_size', 10)
+            pages = max(1, (len(player.queue) + page_size - 1) // page_size)
+            page = min(max(1, int(args[0]) if args and args[0].isdigit() else 1), pages)
+            start = (page - 1) * page_size
+
+            # Only the requested page is read from the queue
+            desc = [f'{start+i+1}: {t.title[:80]}' for i, t in enumerate(player.list(start, page_size))]
             if len(desc) == 0:
                 desc = ['_none_']
                 
@@ -250,12 +401,39 @@ class ShuffleBot(commands.Cog):
 
             embed = discord.Embed()
             embed.add_field(name='Current', value=current_track, inline=False)
-            embed.add_field(name='Queue', value=desc_str, inline=False)
+            embed.add_field(name=f'Queue ({len(player.queue)} tracks, page {page}/{pages})', value=desc_str, inline=False)
             await ctx.channel.send(embed=embed)
         except Exception as e:
             self.logger.error(f"Error listing queue: {str(e)}")
             await ctx.channel.send(f"Error listing queue: {str(e)}")
 
+    # Remove a track from the queue by its position
+    async def remove(self, ctx, player: Player, *args):
+        if not args[0].isdigit() or not 1 <= int(args[0]) <= len(player.queue):
+            await ctx.channel.send(f'No track at position `{args[0]}`')
+            return
+
+        try:
+            track = await player.remove(int(args[0]) - 1)
+            await ctx.channel.send(f'Removed `{track.title}` from the queue')
+        except Exception as e:
+            self.logger.error(f"Error removing track: {str(e)}")
+            await ctx.channel.send(f"Error removing track: {str(e)}")
+
+    # Move a track to another position in the queue
+    async def move(self, ctx, player: Player, *args):
+        length = len(player.queue)
+        if not all(a.isdigit() and 1 <= int(a) <= length for a in args[:2]):
+            await ctx.channel.send(f'Positions must be between 1 and {length}')
+            return
+
+        try:
+            track = await player.move(int(args[0]) - 1, int(args[1]) - 1)
+            await ctx.channel.send(f'Moved `{track.title}` to position {args[1]}')
+        except Exception as e:
+            self.logger.error(f"Error moving track: {str(e)}")
+            await ctx.channel.send(f"Error moving track: {str(e)}")
+
     # ADMIN COMMANDS
     # Empty the queue
     async def clear(self, ctx, player, *args):
@@ -267,13 +445,29 @@ class ShuffleBot(commands.Cog):
             await ctx.channel.send(f"Error clearing queue: {str(e)}")
     
     async def help(self, msg: discord.Message, player, *args):
-        await self.helper.send_bot_help(msg.channel, self.config['prefix'])
+        await self.helper.send_bot_help(msg.channel, player.guild.prefix)
+
+    # Show or change this server's command prefix
+    async def prefix(self, ctx: discord.Message, player: Player, *args):
+        if len(args) == 0:
+            await ctx.channel.send(f'Prefix is `{player.guild.prefix}`')
+            return
+
+        try:
+            guild = await self.guild_configs.update(player.guild.id, prefix=args[0])
+            player.guild = guild
+            await ctx.channel.send(f'Prefix set to `{guild.prefix}`')
+        except ValueError as e:
+            await ctx.channel.send(str(e))
+        except Exception as e:
+            self.logger.error(f"Error setting prefix: {str(e)}")
+            await ctx.channel.send(f"Error setting prefix: {str(e)}")
 
     # Get command author's voice channel, if it exists
     def _get_voice_channel(self, ctx) -> Optional[discord.VoiceChannel]:
         target = ctx.author
         if target.voice != None and target.voice.channel != None:
-            self.logger.debug(f'Got target ({target.display_name}) channel: {target.voice.channel.name}')
+            self.logger.debug('Got target (%s) channel: %s', target.display_name, target.voice.channel.name)
             return target.voice.channel
         else: # no voice channel, do nothing
             self.logger.info(f'No voice channel for target {target.display_name}')
@@ -290,11 +484,69 @@ class ShuffleBot(commands.Cog):
             # Provide default config to prevent crash
             self.config = {"prefix": "!", "download_path": "/var/lib/shuffle/audio"}
 
-    def _get_player(self, guild_id: int) -> Player:
+    async def _sweep_players(self):
+        interval = self.config.get('player_sweep_interval', 60.0)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle_players()
+            except Exception as e:
+                self.logger.error(f'Error evicting idle players: {str(e)}')
+
+    async def evict_idle_players(self) -> int:
+        """Drop players that have been idle for `player_idle_ttl` seconds.
+
+        Their queues are checkpointed and written before they go (empty ones are
+        deleted), so the next command in the guild restores them as they were.
+        """
+        ttl = self.config.get('player_idle_ttl', 1800)
+        now = time.monotonic()
+
+        evicted = [
+            player for guild_id, player in self.players.items()
+            if guild_id not in self._restoring and player.evictable(ttl, now)
+        ]
+        if not evicted:
+            return 0
+
+        # Out of the dict before anything is awaited, a command arriving meanwhile gets a fresh player
+        for player in evicted:
+            del self.players[player.guild.id]
+            player._checkpoint()
+
+        # Written before any restore of these guilds can read them, the store runs in order
+        snapshots = get_snapshot_store(self.config)
+        if snapshots is not None:
+            await snapshots.flush()
+
+        for player in evicted:
+            await player.close()
+
+        PLAYERS_EVICTED.inc(amount=len(evicted))
+        self.logger.info(f'Evicted {len(evicted)} idle players, {len(self.players)} left')
+        return len(evicted)
+
+    async def _get_player(self, guild_id: int) -> Player:
         if guild_id not in self.players:
-            self.logger.debug(f'Creating player for guild {guild_id}')
+            self.logger.debug('Creating player for guild %s', guild_id)
             self.players[guild_id] = Player(guild_id, self.config, self.bot)
-        return self.players[guild_id]
+            self._restoring[guild_id] = asyncio.get_event_loop().create_task(
+                self.players[guild_id].restore(self.bot.get_channel)
+            )
+
+        # Commands arriving while the snapshot loads wait for it, so they see the restored queue
+        if guild_id in self._restoring:
+            await asyncio.shield(self._restoring[guild_id])
+            self._restoring.pop(guild_id, None)
+
+        # Pick up settings reloaded after an invalidation
+        player = self.players[guild_id]
+        player.touch()
+        guild = await self.guild_configs.get(guild_id)
+        if player.guild is not guild:
+            player.guild = guild
+
+        return player
 
 class ShuffleHelp(commands.HelpCommand):
     '''Bot commands help'''
@@ -306,7 +558,7 @@ class ShuffleHelp(commands.HelpCommand):
         
 
     async def send_bot_help(self, channel, prefix):
-        embed = discord.Embed(title=f'Shuffle help:')
+        embed = discord.Embed(title='Shuffle help:')
         for cmd_name, cmd in self.commands.items():
 
             # skip commands that have a permission besides 'any', or are disabled
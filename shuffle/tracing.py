@@ -0,0 +1,168 @@
+import contextvars
+import itertools
+import json
+import logging
+import threading
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from shuffle.metrics import registry
+
+# Seconds, from a command arriving to audio going out takes anywhere from a cache hit to a slow search
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 20.0, 30.0)
+
+SPAN_SECONDS = registry.histogram(
+    'shuffle_span_seconds', 'Traced request duration, start to finish', ('span', 'outcome'), buckets=SPAN_BUCKETS
+)
+SPAN_STAGE_SECONDS = registry.histogram(
+    'shuffle_span_stage_seconds', 'Time spent in each stage of a traced request, since the previous stage',
+    ('span', 'stage'), buckets=SPAN_BUCKETS
+)
+
+# The span of the request the running task works for, inherited by tasks it creates
+_current: 'contextvars.ContextVar[Optional[Span]]' = contextvars.ContextVar('shuffle_span', default=None)
+
+class Span:
+    """One traced request, with the time each named stage was reached.
+
+    Stages are marked from the event loop or any thread, the first mark of a stage
+    counts. `finish` is also idempotent: the first outcome is logged as one JSON line
+    and fed to the per-stage histograms, later marks and finishes are ignored.
+    """
+
+    __slots__ = ('tracer', 'name', 'id', 'attrs', 'outcome', '_started_at', '_stages', '_finished', '_lock')
+
+    def __init__(self, tracer: 'Tracer', name: str, id: int, attrs: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.id = id
+        self.attrs = attrs
+        self.outcome: Optional[str] = None
+
+        self._started_at = time.perf_counter()
+        self._stages: List[Tuple[str, float]] = []
+        self._finished = False
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def mark(self, stage: str) -> None:
+        at = time.perf_counter() - self._started_at
+        with self._lock:
+            if self._finished or any(name == stage for name, _ in self._stages):
+                return
+            self._stages.append((stage, at))
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self, outcome: str = 'ok') -> None:
+        duration = time.perf_counter() - self._started_at
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.outcome = outcome
+            stages = list(self._stages)
+
+        self.tracer._record(self, outcome, duration, stages)
+
+    def to_dict(self, duration: float, stages: List[Tuple[str, float]]) -> Dict[str, Any]:
+        return {
+            'span': self.name,
+            'id': self.id,
+            'outcome': self.outcome,
+            'duration_ms': round(duration * 1000, 1),
+            'stages_ms': {stage: round(at * 1000, 1) for stage, at in stages},
+            **self.attrs,
+        }
+
+    def __repr__(self) -> str:
+        return f'Span[{self.name}#{self.id}, stages={len(self._stages)}, outcome={self.outcome}]'
+
+
+class Tracer:
+    """Starts spans and aggregates finished ones into latency histograms.
+
+    Each stage's histogram records the time since the previous stage, so the
+    percentiles show which stage a slow request spent its time in.
+    """
+
+    def __init__(self, enabled: bool = True, logger: Optional[logging.Logger] = None) -> None:
+        self.enabled = enabled
+        self.logger = logger or logging.getLogger(__name__)
+        self._ids = itertools.count(1)
+
+        self.started = 0
+        self.finished = 0
+
+    def start(self, name: str, **attrs: Any) -> Optional[Span]:
+        """Start a span and make it current for this task and the tasks it creates, None if disabled"""
+        if not self.enabled:
+            return None
+
+        span = Span(self, name, next(self._ids), attrs)
+        _current.set(span)
+        self.started += 1
+        return span
+
+    def _record(self, span: Span, outcome: str, duration: float, stages: List[Tuple[str, float]]) -> None:
+        self.finished += 1
+        SPAN_SECONDS.observe(duration, span.name, outcome)
+
+        previous = 0.0
+        for stage, at in stages:
+            SPAN_STAGE_SECONDS.observe(at - previous, span.name, stage)
+            previous = at
+
+        fields = span.to_dict(duration, stages)
+        self.logger.info(json.dumps(fields, default=str), extra={'fields': fields})
+
+    def __repr__(self) -> str:
+        return f'Tracer[enabled={self.enabled}, started={self.started}]'
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+def mark(stage: str) -> None:
+    """Mark a stage on the current task's span, if it has one"""
+    span = _current.get()
+    if span is not None:
+        span.mark(stage)
+
+def detach() -> Optional[Span]:
+    """Take the current span, so work started from here on is no longer attributed to it.
+
+    Returns the span if it is still open, for the caller to mark and finish directly.
+    """
+    span = _current.get()
+    _current.set(None)
+    return span if span is not None and not span.finished else None
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+def get_tracer(config: dict, logger: Optional[logging.Logger] = None) -> Tracer:
+    """Get the process-wide tracer, created from the config on first use"""
+    global _tracer
+
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(enabled=config.get('tracing', True), logger=logger)
+        return _tracer
+
+
+# Finished spans are counted by shuffle_span_seconds, open ones that never finish show up here
+registry.counter_callback('shuffle_spans_started_total', 'Traced requests started',
+                          lambda: [((), _tracer.started)] if _tracer is not None else [])
+registry.gauge_callback('shuffle_spans_open', 'Traced requests started and not yet finished',
+                        lambda: [((), _tracer.started - _tracer.finished)] if _tracer is not None else [])